@@ -1,13 +1,32 @@
 import json
-import os
 import asyncio
 import openai
-import argparse
 import re
-from tqdm import tqdm
-import time
-import base64
-from mimetypes import guess_type
+import sys
+from functools import lru_cache
+
+# 优先使用orjson读写JSON，未安装时回退到标准库json
+# orjson.JSONDecodeError是json.JSONDecodeError的子类，原有的异常处理无需修改
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads
+
+# 模块中用到的正则表达式统一在此预编译，各函数直接复用
+# LLM响应中```json代码块的内容
+JSON_CODE_BLOCK_PATTERN = re.compile(r'```json\s*([\s\S]*?)```')
+# 单次扫描LLM输出所用的模式：param_dependent格式SQL对象的开头，或以SELECT、INSERT、UPDATE、DELETE等开头、以分号结尾的语句
+# 使用[^;]*代替非贪婪的[\s\S]*?，匹配结果相同，但每个位置不再需要逐字符回溯尝试分号
+SQL_TOKEN_PATTERN = re.compile(
+    r'(?P<param_dependent>{\s*"type"\s*:\s*"param_dependent")'
+    r'|(?P<sql>(?i:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[^;]*;)'
+)
+# param_dependent格式SQL对象的开头，用于检查一条SQL匹配是否越过了对象开头
+PARAM_DEPENDENT_START_PATTERN = re.compile(r'{\s*"type"\s*:\s*"param_dependent"')
+# 用于从param_dependent对象开头解析出完整对象，括号匹配由标准库的C扫描器按JSON语法完成
+JSON_DECODER = json.JSONDecoder()
 
 CODE_ORM_MYSQL_SQL_EXTRACT = \
     "这是一段基于gorm框架的ORM代码。gorm是Go语言的优秀ORM库，支持模型关联、事务处理、钩子方法、自动迁移、自定义类型等多种功能。" \
@@ -278,16 +297,48 @@ CODE_ORM_MYSQL_SQL_FORMAT = \
 
 
 
-async def process_json_file_async(input_file, output_file, concurrency=80):
-    """处理JSON文件并将结果保存到单个文件中，包含SQL语句"""
+def load_json_file(path):
+    """读取并解析JSON文件"""
+    # 以二进制方式一次性读入，交给解析器直接处理UTF-8字节，省去文本层的逐块解码
+    with open(path, 'rb') as file:
+        return json_loads(file.read())
+
+def dump_json_file(data, path):
+    """将数据以缩进2格、保留非ASCII字符的格式写入JSON文件"""
+    if orjson:
+        # orjson在C中完成序列化，一次写出全部字节
+        with open(path, 'wb') as file:
+            file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+
+def dump_jsonl_file(records, path):
+    """将记录逐条写入JSON Lines文件，每行一条记录"""
+    # 逐条序列化后立即写出，不在内存中拼接整份输出
+    if orjson:
+        with open(path, 'wb', buffering=1 << 20) as file:
+            for record in records:
+                file.write(orjson.dumps(record))
+                file.write(b'\n')
+    else:
+        with open(path, 'w', encoding='utf-8', buffering=1 << 20) as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False))
+                file.write('\n')
+
+async def process_json_file_async(input_file, output_file, concurrency=80, jsonl=False):
+    """处理JSON文件并将结果保存到单个文件中，包含SQL语句
+
+    jsonl为True时按JSON Lines格式输出，每行一个函数的结果
+    """
     # 验证输入文件
     if not validate_input_file(input_file):
         print("输入文件验证失败，终止处理")
         return 0, 0
     
     # 读取输入文件
-    with open(input_file, 'r', encoding='utf-8') as file:
-        data = json.load(file)
+    data = load_json_file(input_file)
     
     # 创建信号量控制并发请求数
     semaphore = asyncio.Semaphore(concurrency)
@@ -573,24 +624,26 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
                 function_info['sql_length_match'] = True
     
     # 将结果写入输出文件
-    result_dict = {}
-    for function_info in all_functions:
-        function_name = function_info['function_name']
-        result_dict[function_name] = function_info
-    
-    # 检查输入文件格式，决定输出格式
-    with open(input_file, 'r', encoding='utf-8') as file:
-        input_data = json.load(file)
-    
-    # 如果输入是列表格式，输出也用列表格式
-    if isinstance(input_data, list):
-        output_data = list(result_dict.values())
+    if jsonl:
+        # JSON Lines格式：每个函数的结果单独成行，逐条写出
+        dump_jsonl_file(all_functions, output_file)
     else:
-        # 如果输入是字典格式，输出也用字典格式
-        output_data = result_dict
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+        result_dict = {}
+        for function_info in all_functions:
+            function_name = function_info['function_name']
+            result_dict[function_name] = function_info
+        
+        # 检查输入文件格式，决定输出格式
+        input_data = load_json_file(input_file)
+        
+        # 如果输入是列表格式，输出也用列表格式
+        if isinstance(input_data, list):
+            output_data = list(result_dict.values())
+        else:
+            # 如果输入是字典格式，输出也用字典格式
+            output_data = result_dict
+        
+        dump_json_file(output_data, output_file)
     
     print(f"处理完成，已将结果保存到 {output_file}")
     
@@ -607,15 +660,14 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
 
 
 
-def process_json_file(input_file, output_file, concurrency=80):
+def process_json_file(input_file, output_file, concurrency=80, jsonl=False):
     """同步版本的处理函数"""
-    return asyncio.run(process_json_file_async(input_file, output_file, concurrency))
+    return asyncio.run(process_json_file_async(input_file, output_file, concurrency, jsonl))
 
 # 添加输入验证
 def validate_input_file(input_file):
     try:
-        with open(input_file, 'r', encoding='utf-8') as file:
-            data = json.load(file)
+        data = load_json_file(input_file)
         
         # 验证必要字段
         if isinstance(data, dict):
@@ -678,20 +730,21 @@ def classify_sql(sql_statement):
     else:
         return "OTHER"
 
+# 所有请求共用同一个客户端，复用其httpx连接池和keep-alive连接，避免每个请求都重新建立连接
+LLM_CLIENT = openai.AsyncClient(
+    base_url="http://0.0.0.0:8081/v1", 
+    api_key="EMPTY"
+)
+
 # 添加缺失的函数
 async def send_request_async(question, semaphore):
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://0.0.0.0:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         max_retries = 3
         retry_count = 0
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
+                response = await LLM_CLIENT.chat.completions.create(
                     model="default",
                     messages=[
                         {"role": "system", "content": ""},
@@ -711,11 +764,6 @@ async def send_request_async(question, semaphore):
 
 async def verify_sql_async(sql_statement, code_value=None, code_meta_data=None, caller=None, semaphore=None, sql_pattern_cnt=None):
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://0.0.0.0:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         # 构建提示词，使用CODE_ORM_MYSQL_SQL_VERIFY模板
         code_chain = ""
         if code_meta_data and len(code_meta_data) > 0:
@@ -738,7 +786,7 @@ async def verify_sql_async(sql_statement, code_value=None, code_meta_data=None,
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
+                response = await LLM_CLIENT.chat.completions.create(
                     model="default",
                     messages=[
                         {"role": "system", "content": "你是一个SQL专家，擅长分析和修正SQL语句。"},
@@ -759,11 +807,6 @@ async def verify_sql_async(sql_statement, code_value=None, code_meta_data=None,
 
 async def format_sql_async(sql_statement, semaphore):
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://0.0.0.0:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         # 构建提示词，使用CODE_ORM_MYSQL_SQL_FORMAT模板
         prompt = CODE_ORM_MYSQL_SQL_FORMAT.format(
             sql_statement=sql_statement
@@ -774,7 +817,7 @@ async def format_sql_async(sql_statement, semaphore):
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
+                response = await LLM_CLIENT.chat.completions.create(
                     model="default",
                     messages=[
                         {"role": "system", "content": "你是一个SQL格式化专家，擅长将SQL语句转换为标准JSON格式。"},
@@ -790,7 +833,7 @@ async def format_sql_async(sql_statement, semaphore):
                     # 检查是否包含```json标记
                     if "```json" in formatted_response:
                         # 提取json部分
-                        match = re.search(r'```json\s*([\s\S]*?)```', formatted_response)
+                        match = JSON_CODE_BLOCK_PATTERN.search(formatted_response)
                         if match:
                             json_content = match.group(1).strip()
                             # 解析提取出的json内容
@@ -903,51 +946,88 @@ def fix_malformed_json_array(json_str):
         return extract_sql_statements(json_str)
 
 def extract_sql_statements(text):
-    """从文本中提取SQL语句"""
+    """从文本中提取SQL语句
+
+    说明文字中出现SQL关键字（如updated_at）时，其后的param_dependent对象仍被完整解析：
+
+    >>> extract_sql_statements('根据updated_at字段判断\\n{"type": "param_dependent", "variants": [{"sql": "SELECT * FROM t WHERE id = 1;"}, {"sql": "SELECT * FROM t WHERE id = 2;"}]}')
+    [{'type': 'param_dependent', 'variants': [{'sql': 'SELECT * FROM t WHERE id = 1;'}, {'sql': 'SELECT * FROM t WHERE id = 2;'}]}]
+
+    说明文字中先于对象出现的变体SQL同样被去重，比较前按normalize_sql规范化，与大小写和空白无关：
+
+    >>> extract_sql_statements('先执行 SELECT * FROM t WHERE id = 1;\\n{"type": "param_dependent", "variants": [{"sql": "SELECT * FROM t WHERE id = 1;"}, {"sql": "SELECT * FROM t WHERE id = 2;"}]}')
+    [{'type': 'param_dependent', 'variants': [{'sql': 'SELECT * FROM t WHERE id = 1;'}, {'sql': 'SELECT * FROM t WHERE id = 2;'}]}]
+    >>> extract_sql_statements('先执行 select *  from t\\n  where id = 2;\\n{"type": "param_dependent", "variants": [{"sql": "SELECT * FROM t WHERE id = 1;"}, {"sql": "SELECT * FROM t WHERE id = 2;"}]}')
+    [{'type': 'param_dependent', 'variants': [{'sql': 'SELECT * FROM t WHERE id = 1;'}, {'sql': 'SELECT * FROM t WHERE id = 2;'}]}]
+    """
     # 这个函数尝试从文本中提取SQL语句，适用于LLM返回了带有说明的文本而不是纯JSON
     
-    # 尝试提取param_dependent格式的SQL
-    param_dependent_matches = re.findall(r'{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*}', text, re.DOTALL)
-    
-    # 一般性SQL语句提取
-    # 查找以SELECT、INSERT、UPDATE、DELETE等开头，以分号结尾的语句
-    sql_matches = re.findall(r'(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[\s\S]*?;', text, re.IGNORECASE)
-    
-    # 合并结果
+    # 从左到右只扫描一遍，提取param_dependent对象和一般SQL语句
+    # param_dependent对象整体被跳过，其内部变体的SQL不会被再次提取
     result = []
+    sql_matches = []
+    # 已提取变体SQL的规范化形式，用于丢弃在说明文字中被再次原样输出的同一条变体SQL
+    variant_sqls = set()
+    pos = 0
+    while True:
+        match = SQL_TOKEN_PATTERN.search(text, pos)
+        if not match:
+            break
+        
+        if match.lastgroup == 'param_dependent':
+            try:
+                # 按JSON语法解析到对象结束，字符串中的括号（如"[其他字段]"）不会干扰匹配
+                parsed, pos = JSON_DECODER.raw_decode(text, match.start())
+                result.append(parsed)
+                variant_sqls.update(
+                    normalize_sql(variant['sql'])
+                    for variant in parsed.get('variants', [])
+                    if isinstance(variant, dict) and isinstance(variant.get('sql'), str)
+                )
+            except json.JSONDecodeError:
+                # 对象不完整（如LLM输出被截断），跳过对象开头，继续提取其中的SQL语句
+                pos = match.end()
+            continue
+        
+        # 说明文字中的关键字（如updated_at、UPDATE操作）会让SQL匹配一直延伸到对象内部的第一个分号，
+        # 此时丢弃这段匹配，从对象开头重新扫描，使对象能被完整解析
+        opener = PARAM_DEPENDENT_START_PATTERN.search(text, match.start(), match.end())
+        if opener:
+            pos = opener.start()
+            continue
+        
+        sql_matches.append(match.group())
+        pos = match.end()
     
-    # 添加param_dependent类型
-    for match in param_dependent_matches:
-        try:
-            # 尝试将提取的内容解析为JSON
-            parsed = json.loads(match)
-            result.append(parsed)
-        except json.JSONDecodeError:
-            # 如果解析失败，将其作为字符串添加
-            result.append(match)
-    
-    # 添加常规SQL语句
-    for match in sql_matches:
-        # 检查是否已经作为param_dependent的一部分添加
-        already_added = False
-        for item in result:
-            if isinstance(item, dict) and 'variants' in item:
-                for variant in item['variants']:
-                    if match in variant.get('sql', ''):
-                        already_added = True
-                        break
-        
-        if not already_added:
-            result.append(match)
+    # 一般SQL语句在扫描结束、所有变体SQL都已收集后再过滤，
+    # 说明文字中先于对象出现的变体SQL同样会被丢弃
+    for sql in sql_matches:
+        # 与已提取的变体SQL做规范化后的精确比较，而不是子串查找，
+        # 避免仅因为是某个变体的一部分就被误判为重复
+        if normalize_sql(sql) in variant_sqls:
+            continue
+        # LLM经常重复输出相同的SQL，驻留后相同语句共享同一个字符串对象，
+        # 后续比较可以直接命中身份相等的快速路径
+        result.append(sys.intern(sql))
     
     # 如果没有找到任何SQL语句，将原始文本分割为语句
+    # 每个片段只strip一次并直接写入result，不再构造两个中间列表
     if not result:
-        statements = [stmt.strip() for stmt in text.split(';') if stmt.strip()]
-        statements = [f"{stmt};" for stmt in statements if not stmt.startswith('{') and not stmt.startswith('[')]
-        result.extend(statements)
+        for stmt in text.split(';'):
+            stmt = stmt.strip()
+            # 跳过空片段和JSON残片
+            if stmt and stmt[0] not in '{[':
+                result.append(sys.intern(f"{stmt};"))
     
     return result
 
+# 按SQL文本缓存规范化结果，同一变体在多次比较中只需规范化一次
+@lru_cache(maxsize=65536)
+def normalize_sql(sql):
+    """将SQL语句规范化为用于比较的形式：合并空白、去除末尾分号并转为小写"""
+    # split()/join()在C层完成空白合并与首尾去除，与re.sub(r'\s+', ' ', sql).strip()结果一致
+    return ' '.join(sql.split()).rstrip(';').lower()
+
 # 添加函数用于比较两个SQL语句是否重复
 def compare_sql_statements(sql1, sql2):
     """比较两个SQL语句是否实质上相同"""
@@ -955,48 +1035,36 @@ def compare_sql_statements(sql1, sql2):
     if sql1 == sql2:
         return True
     
-    # 如果一个是字符串，一个是字典，它们不相同
-    if (isinstance(sql1, str) and isinstance(sql2, dict)) or \
-       (isinstance(sql1, dict) and isinstance(sql2, str)):
+    # 每个参数只做一次类型判断
+    if isinstance(sql1, str):
+        # 如果一个是字符串，另一个不是，它们不相同
+        if not isinstance(sql2, str):
+            return False
+        # 如果都是字符串，移除空格、换行和分号进行简化比较
+        return normalize_sql(sql1) == normalize_sql(sql2)
+    
+    # 只有都是字典（变体SQL）时才需要继续比较
+    if not (isinstance(sql1, dict) and isinstance(sql2, dict)):
         return False
     
-    # 如果都是字符串，进行简化比较
-    if isinstance(sql1, str) and isinstance(sql2, str):
-        # 移除空格、换行和分号进行比较
-        simplified1 = re.sub(r'\s+', ' ', sql1).strip().rstrip(';').lower()
-        simplified2 = re.sub(r'\s+', ' ', sql2).strip().rstrip(';').lower()
-        return simplified1 == simplified2
-    
-    # 如果都是字典（变体SQL）
-    if isinstance(sql1, dict) and isinstance(sql2, dict):
-        # 如果类型不同
-        if sql1.get('type') != sql2.get('type'):
-            return False
-        
-        # 比较变体数量
-        variants1 = sql1.get('variants', [])
-        variants2 = sql2.get('variants', [])
-        
-        if len(variants1) != len(variants2):
-            return False
-        
-        # 简单检查：检查是否有相同数量的变体具有相同的SQL
-        sql_set1 = set()
-        for variant in variants1:
-            if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
-                sql_set1.add(simplified)
-        
-        sql_set2 = set()
-        for variant in variants2:
-            if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
-                sql_set2.add(simplified)
-        
-        # 如果两个集合有重叠，认为它们可能是相同的SQL
-        return len(sql_set1.intersection(sql_set2)) > 0
+    # 如果类型不同
+    if sql1.get('type') != sql2.get('type'):
+        return False
+    
+    # 比较变体数量
+    variants1 = sql1.get('variants', [])
+    variants2 = sql2.get('variants', [])
+    
+    if len(variants1) != len(variants2):
+        return False
+    
+    # 简单检查：检查是否有相同数量的变体具有相同的SQL
+    sql_set1 = {normalize_sql(variant['sql']) for variant in variants1 if 'sql' in variant}
+    sql_set2 = {normalize_sql(variant['sql']) for variant in variants2 if 'sql' in variant}
     
-    return False
+    # 如果两个集合有重叠，认为它们可能是相同的SQL
+    # isdisjoint在找到第一个公共元素时即返回，无需构造完整交集
+    return not sql_set1.isdisjoint(sql_set2)
 
 if __name__ == '__main__':
     # 导入必要的库
@@ -1011,13 +1079,15 @@ if __name__ == '__main__':
     parser.add_argument('--input', type=str, default=input_file, help='输入JSON文件路径')
     parser.add_argument('--output', type=str, default=output_file, help='输出JSON文件路径')
     parser.add_argument('--concurrency', type=int, default=80, help='并发请求数量')
+    parser.add_argument('--jsonl', action='store_true', help='以JSON Lines格式输出，每行一个函数的结果')
     args = parser.parse_args()
     
     # 处理JSON文件
     valid_count, invalid_count = process_json_file(
         args.input, 
         args.output, 
-        args.concurrency
+        args.concurrency,
+        args.jsonl
     )
     
     print(f"统计结果: 有效ORM {valid_count}个, 无效ORM {invalid_count}个")
@@ -1,14 +1,57 @@
 import json
+import hashlib
 import os
 import asyncio
 import openai
+import httpx
+import random
 import argparse
 import re
+import sys
+import logging
 from tqdm import tqdm
 import time
 import base64
 from mimetypes import guess_type
+from functools import lru_cache
 
+# 优先使用orjson读写JSON，未安装时回退到标准库json
+# orjson.JSONDecodeError是json.JSONDecodeError的子类，原有的异常处理无需修改
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads
+
+# 重试、不完整SQL等逐条出现的诊断信息通过日志输出，消息在日志级别允许时才格式化
+logger = logging.getLogger(__name__)
+
+# 模块中用到的正则表达式统一在此预编译，各函数直接复用
+# LLM响应中```json代码块的内容
+JSON_CODE_BLOCK_PATTERN = re.compile(r'```json\s*([\s\S]*?)```')
+# 单次扫描LLM输出所用的模式：param_dependent格式的SQL变体对象，或以SELECT、INSERT等关键字开头、以分号结尾的SQL语句
+# 使用[^;]*代替非贪婪的[\s\S]*?，匹配范围相同，但无需在每个字符处尝试匹配结尾
+SQL_TOKEN_PATTERN = re.compile(
+    r'(?P<param_dependent>{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*})'
+    r'|(?P<sql>(?i:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[^;]*;)',
+    re.DOTALL
+)
+# param_dependent格式SQL对象的开头，用于检查一条SQL匹配是否越过了对象开头
+PARAM_DEPENDENT_START_PATTERN = re.compile(r'{\s*"type"\s*:\s*"param_dependent"')
+# SQL语句开头的语句类型关键字（允许前导空白，不区分大小写）
+SQL_TYPE_PATTERN = re.compile(r'\s*(select|insert|update|delete)', re.IGNORECASE)
+# SQL中的省略号或[其他字段]类型的占位符，一次扫描代替三次子串查找
+PLACEHOLDER_PATTERN = re.compile(r'\.\.\.|\[其他|其他\]')
+# 含占位符的SQL被标记为不完整时添加的前缀，下游可用startswith判断
+INCOMPLETE_SQL_PREFIX = "不完整SQL语句: "
+# JSON值可能的首字符（数组、对象、字符串、数字、true/false/null）
+JSON_VALUE_START_CHARS = frozenset('[{"-0123456789tfn')
+# Go代码中的行注释（//前为行首或空白，避免误伤http://等字符串内容）
+GO_LINE_COMMENT_PATTERN = re.compile(r'(?:^|(?<=\s))//[^\n]*', re.MULTILINE)
+
+# 提示词模板中，固定的说明文字与常量定义放在前部，随函数变化的内容统一放在末尾，
+# 使各次请求共享尽可能长的相同前缀，便于推理服务复用前缀缓存
 CODE_ORM_MYSQL_SQL_EXTRACT = \
     "这是一段基于gorm框架的ORM代码。gorm是Go语言的优秀ORM库，支持模型关联、事务处理、钩子方法、自动迁移、自定义类型等多种功能。" \
     "请注意，这是一个ORM代码块，它一定会转换并生成SQL语句，请务必分析出所有可能的SQL语句。\n" \
@@ -102,19 +145,22 @@ CODE_ORM_MYSQL_SQL_EXTRACT = \
     "- 请先按入参场景分类\n" \
     "- 在每个入参场景下，按顺序列出该场景会执行的所有SQL语句\n" \
     "- 清晰区分不同场景和不同SQL语句\n" \
-    "根据代码分析，该函数应该生成 {sql_pattern_cnt} 条SQL语句。请确保你的分析包含正确数量的SQL语句（或SQL变体组）。\n" \
+    "请确保你的分析包含正确数量的SQL语句（或SQL变体组），应生成的数量见下方说明：\n" \
     "- 如果一个SQL语句有多个变体（因参数不同而结构不同），这仍然算作一条SQL语句\n" \
     "- 请仔细检查是否遗漏了某些SQL语句或错误地添加了不应该存在的SQL语句\n" \
     "请确保分析全面，考虑代码中的条件判断、循环、动态拼接等可能影响SQL结构生成的因素，输出所有可能的sql语句。" \
     "特别注意区分\"仅参数值不同\"和\"SQL结构不同\"这两种情况。\n\n" \
-    "函数名称：{function_name}\n\n" \
-    "ORM代码：{code_value}\n\n" \
-    "调用者：{caller}\n\n" \
-    "元数据：\n{code_meta_data_str}" \
+    "已知的表名常量定义：\n" \
     "const ( \n" \
     "TableNameSpaceRouter       = \"space_router\" \n" \
     "TableNameSpaceRouterBackup = \"space_router_backup\" \n" \
     ")\n" \
+    "\n" \
+    "根据代码分析，该函数应该生成 {sql_pattern_cnt} 条SQL语句。\n\n" \
+    "函数名称：{function_name}\n\n" \
+    "ORM代码：{code_value}\n\n" \
+    "调用者：{caller}\n\n" \
+    "元数据：\n{code_meta_data_str}"
 
 CODE_ORM_MYSQL_SQL_VERIFY = \
     "请检查以下从gorm ORM代码生成的SQL语句分析是否准确，并将所有SQL语句以JSON格式返回。请记住，这是一个ORM代码块，它一定会生成SQL语句，不要遗漏任何可能的SQL。\n\n" \
@@ -185,20 +231,23 @@ CODE_ORM_MYSQL_SQL_VERIFY = \
     "- 仅仅是参数值不同但SQL结构相同的情况，应该只列出一个代表性变体\n" \
     "- 示例：'WHERE id = 1' 和 'WHERE id = 2' 不是不同的变体，而是同一变体的不同参数\n" \
     "- 示例：'WHERE id = ?' 和 'WHERE name = ?' 是结构不同的变体，因为条件列不同\n" \
-    "6. 根据ORM代码分析，该函数应该生成 {sql_pattern_cnt} 条SQL语句。请确保你的输出包含正确数量的SQL语句（或SQL变体组）。\n" \
+    "6. 请确保你的输出包含正确数量的SQL语句（或SQL变体组），应生成的数量见下方说明：\n" \
     "- 如果一个SQL语句有多个变体（因参数不同而结构不同），这仍然算作一条SQL语句\n" \
     "- 请仔细检查是否遗漏了某些SQL语句或错误地添加了不应该存在的SQL语句\n" \
     "7. 请确保返回的是纯JSON格式，不要添加任何解释性文本。\n" \
     "8. 如果发现原始分析中的SQL语句有错误或不完整（如含有省略号、[其他字段]等占位符），请修正并补全完整的字段列表和参数。\n" \
     "9. 请确保返回的是纯JSON格式，不要添加任何解释性文本。\n\n" \
-    "以下是需要检查的SQL语句分析：\n" \
-    "函数定义：{function_definition}\n\n" \
-    "调用者信息：{caller}\n\n" \
-    "相关代码上下文：{code_chain}\n\n" \
+    "已知的表名常量定义：\n" \
     "const ( \n" \
     "TableNameSpaceRouter       = \"space_router\" \n" \
     "TableNameSpaceRouterBackup = \"space_router_backup\" \n" \
     ")\n" \
+    "\n" \
+    "以下是需要检查的SQL语句分析：\n" \
+    "根据ORM代码分析，该函数应该生成 {sql_pattern_cnt} 条SQL语句。\n\n" \
+    "函数定义：{function_definition}\n\n" \
+    "调用者信息：{caller}\n\n" \
+    "相关代码上下文：{code_chain}\n\n" \
     "SQL语句：{sql_statement}"
 
 CODE_ORM_MYSQL_SQL_FORMAT = \
@@ -260,27 +309,227 @@ CODE_ORM_MYSQL_SQL_FORMAT = \
     "6. 如果发现原始分析中的SQL语句有错误或不完整（如含有省略号、[其他字段]等占位符），请修正并补全完整的字段列表和参数。\n\n" \
     "需要格式化的内容：{sql_statement}"
 
+def split_prompt_template(template, marker):
+    """在marker处将提示词模板拆分为固定前缀与动态部分的模板
+
+    固定前缀不含占位符，在此预先完成{{ }}转义的还原，构建提示词时只需格式化较短的动态部分
+    """
+    index = template.index(marker)
+    return template[:index].format(), template[index:]
+
+EXTRACT_PROMPT_PREFIX, EXTRACT_PROMPT_SUFFIX = split_prompt_template(CODE_ORM_MYSQL_SQL_EXTRACT, "根据代码分析，该函数应该生成")
+VERIFY_PROMPT_PREFIX, VERIFY_PROMPT_SUFFIX = split_prompt_template(CODE_ORM_MYSQL_SQL_VERIFY, "以下是需要检查的SQL语句分析：")
+FORMAT_PROMPT_PREFIX, FORMAT_PROMPT_SUFFIX = split_prompt_template(CODE_ORM_MYSQL_SQL_FORMAT, "需要格式化的内容：")
+
+# 合并模式的提示词：沿用生成阶段的分析要求与格式化阶段的JSON输出要求，一次请求直接得到最终的SQL语句数组，
+# 动态部分与生成阶段相同
+ONE_SHOT_PROMPT_PREFIX = \
+    EXTRACT_PROMPT_PREFIX + \
+    "完成上述分析后，不要输出分析过程，直接按以下要求输出最终结果：\n" + \
+    FORMAT_PROMPT_PREFIX[FORMAT_PROMPT_PREFIX.index("1. 输出应该是一个SQL语句数组"):]
+
+
+
+def load_json_file(path):
+    """读取并解析JSON文件"""
+    # 以二进制方式一次性读入，交给解析器直接处理UTF-8字节，省去文本层的逐块解码
+    with open(path, 'rb') as file:
+        return json_loads(file.read())
+
+def dump_json_file(data, path):
+    """将数据以缩进2格、保留非ASCII字符的格式写入JSON文件"""
+    if orjson:
+        # orjson在C中完成序列化，一次写出全部字节
+        with open(path, 'wb') as file:
+            file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+
+def dump_jsonl_file(records, path):
+    """将记录逐条写入JSON Lines文件，每行一条记录"""
+    # 逐条序列化后立即写出，不在内存中拼接整份输出
+    if orjson:
+        with open(path, 'wb', buffering=1 << 20) as file:
+            for record in records:
+                file.write(orjson.dumps(record))
+                file.write(b'\n')
+    else:
+        with open(path, 'w', encoding='utf-8', buffering=1 << 20) as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False))
+                file.write('\n')
+
+def parse_sql_json_list(text):
+    """将LLM返回的文本（可带```json代码块标记）解析为SQL语句数组，不是JSON数组时返回None"""
+    if not isinstance(text, str):
+        return None
+    text = text.strip()
+    match = JSON_CODE_BLOCK_PATTERN.search(text)
+    if match:
+        text = match.group(1).strip()
+    if not (text and text[0] == '[' and text[-1] == ']'):
+        return None
+    try:
+        sql_list = json_loads(text)
+    except json.JSONDecodeError:
+        return None
+    return sql_list if isinstance(sql_list, list) else None
+
+def build_code_chain(code_meta_data):
+    """将code_meta_data中各段代码拼接为一个字符串，每段代码后接换行"""
+    return ''.join(
+        f"{meta}\n" if isinstance(meta, str) else f"{meta['code_value']}\n"
+        for meta in code_meta_data
+        if isinstance(meta, str) or (isinstance(meta, dict) and 'code_value' in meta)
+    )
+
+async def process_function_async(function_info, semaphore, fused=False):
+    """依次完成单个函数的SQL生成、验证与格式化，结果写回function_info并将其返回
 
+    fused为True时先用一次请求直接生成JSON数组，结果无法解析时再进入验证与格式化阶段
+    """
+    function_name = function_info['function_name']
+    
+    # 提取所需信息
+    code_value = function_info.get('code_value', '')
+    
+    # 获取callers的第一个元素（如果存在）
+    caller = ""
+    if function_info.get('callers') and len(function_info['callers']) > 0:
+        caller = function_info['callers'][0]['code_value']
+    
+    # 拼接code_meta_data的所有元素，生成与验证两个阶段共用
+    code_meta_data_str = build_code_chain(function_info.get('code_meta_data', []))
+    # 获取sql_pattern_cnt（如果存在）
+    sql_pattern_cnt = function_info.get('sql_pattern_cnt', None)
+    
+    # 构建提示词，使用CODE_ORM_MYSQL_SQL_EXTRACT模板，合并模式下换用ONE_SHOT_PROMPT_PREFIX
+    prompt_prefix = ONE_SHOT_PROMPT_PREFIX if fused else EXTRACT_PROMPT_PREFIX
+    prompt = prompt_prefix + EXTRACT_PROMPT_SUFFIX.format(
+        function_name=function_name,
+        code_value=code_value,
+        caller=caller,
+        code_meta_data_str=code_meta_data_str,
+        sql_pattern_cnt=sql_pattern_cnt if sql_pattern_cnt is not None else ""
+    )
+    
+    # 生成SQL语句
+    try:
+        sql_statement = await send_request_async(prompt, semaphore, max_tokens_for_sql_count(sql_pattern_cnt))
+    except Exception as e:
+        print(f"SQL生成任务 {function_name} 失败: {e}")
+        # 跳过验证与格式化，由调用方按请求失败处理
+        function_info['sql_statement'] = f"请求失败: {function_name}"
+        return function_info
+    function_info['sql_statement'] = sql_statement
+    
+    # 合并模式下响应已是JSON数组时直接使用，跳过验证与格式化
+    sql_list = parse_sql_json_list(sql_statement) if fused else None
+    if sql_list is None:
+        # 验证SQL语句
+        try:
+            verified_sql = await verify_sql_async(
+                sql_statement, 
+                function_definition=code_value,
+                code_chain=code_meta_data_str,
+                caller=caller,
+                semaphore=semaphore,
+                sql_pattern_cnt=sql_pattern_cnt
+            )
+        except Exception as e:
+            print(f"验证任务 {function_name} 失败: {e}")
+            verified_sql = sql_statement  # 使用原始SQL
+        function_info['verified_sql'] = verified_sql
+        
+        # 验证结果已是JSON数组时直接使用，省去格式化请求
+        sql_list = parse_sql_json_list(verified_sql)
+        if sql_list is None:
+            # 格式化SQL语句
+            try:
+                sql_list = await format_sql_async(verified_sql, semaphore)
+            except Exception as e:
+                print(f"格式化任务 {function_name} 失败: {e}")
+                sql_list = extract_sql_statements(verified_sql)
+    
+    # 如果sql_list仍然是格式不正确的字符串，尝试修复
+    if isinstance(sql_list, str):
+        sql_list = fix_malformed_json_array(sql_list)
+    
+    # 验证SQL语句完整性
+    sql_list = validate_sql_completeness(sql_list)
+    
+    # 将SQL语句列表添加到函数信息中
+    function_info['sql_statement_list'] = sql_list
+    
+    # 添加SQL类型分类
+    sql_types = []
+    for sql in sql_list:
+        sql_types.append(classify_sql(sql))
+    function_info['sql_types'] = sql_types
+    return function_info
 
-async def process_json_file_async(input_file, output_file, concurrency=80):
-    """处理JSON文件并将结果保存到单个文件中，包含SQL语句"""
-    # 验证输入文件
-    if not validate_input_file(input_file):
+def load_checkpoint(checkpoint_file):
+    """读取检查点文件中已完成的函数结果，返回以function_name为键的字典"""
+    finished = {}
+    if not os.path.exists(checkpoint_file):
+        return finished
+    with open(checkpoint_file, 'rb') as file:
+        for line in file:
+            try:
+                record = json_loads(line)
+            except json.JSONDecodeError:
+                # 中断时可能留下写了一半的行，跳过即可，该函数会重新处理
+                continue
+            finished[record['function_name']] = record
+    return finished
+
+def append_checkpoint_record(file, record):
+    """以JSON Lines格式向检查点文件追加一条函数结果并立即刷新到磁盘"""
+    if orjson:
+        file.write(orjson.dumps(record) + b'\n')
+    else:
+        file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+    file.flush()
+
+async def process_json_file_async(input_file, output_file, concurrency=80, cache_file=None,
+                                  max_requests_per_min=None, max_tokens_per_min=None, fused=False, jsonl=False):
+    """处理JSON文件并将结果保存到单个文件中，包含SQL语句
+
+    cache_file不为空时从该文件加载LLM响应缓存，处理结束后写回；
+    max_requests_per_min/max_tokens_per_min用于限制每分钟发出的请求数与token数；
+    fused为True时每个函数先尝试用一次请求完成生成、验证与格式化；
+    jsonl为True时按JSON Lines格式输出，每行一个函数的结果
+    """
+    global LLM_RATE_LIMITER
+    # 读取输入文件，必要字段的检查在下方整理函数信息时一并完成
+    try:
+        data = load_json_file(input_file)
+    except (OSError, ValueError) as e:
+        print(f"输入文件验证失败: {e}")
+        print("输入文件验证失败，终止处理")
+        return 0, 0
+    if not isinstance(data, (dict, list)):
+        print(f"警告: 输入文件格式不是字典或列表类型，而是 {type(data)}")
         print("输入文件验证失败，终止处理")
         return 0, 0
     
-    # 读取输入文件
-    with open(input_file, 'r', encoding='utf-8') as file:
-        data = json.load(file)
+    # 加载LLM响应缓存
+    load_llm_cache(cache_file)
     
     # 创建信号量控制并发请求数
     semaphore = asyncio.Semaphore(concurrency)
+    # 按需创建速率限制器，使请求速度与服务端的处理能力匹配
+    if max_requests_per_min or max_tokens_per_min:
+        LLM_RATE_LIMITER = RateLimiter(max_requests_per_min, max_tokens_per_min)
     
     # 准备所有函数信息
     all_functions = []
     if isinstance(data, dict):
         # 如果是字典类型，按原来的方式处理
         for function_name_or_path, function_info in data.items():
+            if 'code_value' not in function_info:
+                print(f"警告: {function_name_or_path} 缺少 code_value 字段")
             # 确保function_info包含function_name
             function_info['function_name'] = function_name_or_path
             # 默认所有函数都是有效的，跳过验证阶段
@@ -293,6 +542,8 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
             if not isinstance(function_info, dict):
                 print(f"警告: 索引 {i} 处的元素不是字典类型，跳过")
                 continue
+            if 'code_value' not in function_info:
+                print(f"警告: 索引 {i} 处的元素缺少 code_value 字段")
             # 如果没有function_name字段，使用索引作为函数名
             if 'function_name' not in function_info:
                 function_info['function_name'] = f"function_{i}"
@@ -304,228 +555,43 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
     invalid_count = 0
 
 
-    # 为所有ORM代码生成SQL语句
-    print("开始为所有ORM代码生成SQL语句")
-    initial_tasks = []
-    function_info_map = {}
-    
+    # 每个函数完成后立即追加到检查点文件，中断后重新运行时跳过已完成的函数
+    checkpoint_file = f"{output_file}.partial.jsonl"
+    finished = load_checkpoint(checkpoint_file)
+    pending_functions = []
     for function_info in all_functions:
-        function_name = function_info['function_name']
-        print(f"添加SQL生成任务: {function_name}")
-        
-        # 提取所需信息
-        code_value = function_info.get('code_value', '')
-        
-        # 获取callers的第一个元素（如果存在）
-        caller = ""
-        if function_info.get('callers') and len(function_info['callers']) > 0:
-            caller = function_info['callers'][0]['code_value']
-        
-        # 获取code_meta_data的所有元素
-        code_meta_data = function_info.get('code_meta_data', [])
-        code_meta_data_str = ""
-        for meta in code_meta_data:
-            code_meta_data_str += meta['code_value'] + "\n"
-        # 获取sql_pattern_cnt（如果存在）
-        sql_pattern_cnt = function_info.get('sql_pattern_cnt', None)
-        
-        # 构建提示词，使用CODE_ORM_MYSQL_SQL_EXTRACT模板
-        prompt = CODE_ORM_MYSQL_SQL_EXTRACT.format(
-            function_name=function_name,
-            code_value=code_value,
-            caller=caller,
-            code_meta_data_str=code_meta_data_str,
-            sql_pattern_cnt=sql_pattern_cnt if sql_pattern_cnt is not None else ""
-        )
-        
-        # 创建异步任务
-        task = asyncio.create_task(send_request_async(prompt, semaphore))
-        initial_tasks.append(task)
-        
-        # 保存函数信息以便后续处理
-        function_info_map[task] = function_info
-    
-    # 并发等待所有初始任务完成
-    if initial_tasks:
-        print(f"等待所有 {len(initial_tasks)} 个SQL生成任务完成...")
-        initial_results = await asyncio.gather(*initial_tasks, return_exceptions=True)
-    else:
-        initial_results = []
-    
-    # 保存第二阶段检查点
-    for i, sql_statement in enumerate(initial_results):
-        if i >= len(initial_tasks):
-            continue
-            
-        task = initial_tasks[i]
-        function_info = function_info_map[task]
-        
-        # 检查是否有异常
-        if isinstance(sql_statement, Exception):
-            function_info['sql_statement'] = f"请求失败: {str(sql_statement)}"
+        record = finished.get(function_info['function_name'])
+        if record is not None:
+            function_info.update(record)
         else:
-            function_info['sql_statement'] = sql_statement
-    
-    result_dict_phase2 = {}
-    for function_info in all_functions:
-        function_name = function_info['function_name']
-        result_dict_phase2[function_name] = function_info
-    
-    
-    # 验证SQL语句
-    print("开始验证SQL语句")
-    verify_tasks = []
-    verify_map = {}
-    
-    for i, sql_statement in enumerate(initial_results):
-        if i >= len(initial_tasks):
-            continue
-            
-        task = initial_tasks[i]
-        function_info = function_info_map[task]
-        function_name = function_info['function_name']
-        
-        # 检查是否有异常
-        if isinstance(sql_statement, Exception):
-            print(f"SQL生成任务 {function_name} 失败: {sql_statement}")
-            sql_statement = f"请求失败: {function_name}"
-            # 跳过验证
-            function_info['sql_statement'] = sql_statement
-            continue
-        else:
-            print(f"SQL生成任务 {function_name} 完成，开始验证")
-        
-        # 获取sql_pattern_cnt（如果存在）
-        sql_pattern_cnt = function_info.get('sql_pattern_cnt', None)
-        
-        # 构建提示词，使用CODE_ORM_MYSQL_SQL_VERIFY模板
-        code_chain = ""
-        if function_info.get('code_meta_data') and len(function_info['code_meta_data']) > 0:
-            for meta in function_info['code_meta_data']:
-                if isinstance(meta, str):
-                    code_chain += f"{meta}\n"
-                elif isinstance(meta, dict) and 'code_value' in meta:
-                    code_chain += f"{meta.get('code_value', '')}\n"
-        
-        
-        # 创建验证任务
-        verify_task = asyncio.create_task(
-            verify_sql_async(
-                sql_statement, 
-                function_definition=function_info.get('code_value', ''),
-                code_meta_data=function_info.get('code_meta_data', []),
-                caller=caller,
-                semaphore=semaphore,
-                sql_pattern_cnt=sql_pattern_cnt
-            )
-        )
-        verify_tasks.append(verify_task)
-        verify_map[verify_task] = {
-            'function_info': function_info,
-            'original_sql': sql_statement
-        }
-    
-    # 并发等待所有验证任务完成
-    if verify_tasks:
-        print(f"等待所有 {len(verify_tasks)} 个验证任务完成...")
-        verify_results = await asyncio.gather(*verify_tasks, return_exceptions=True)
-    else:
-        verify_results = []
-    
-    # 保存第三阶段检查点
-    for i, verified_sql in enumerate(verify_results):
-        if i >= len(verify_tasks):
-            continue
-            
-        task = verify_tasks[i]
-        task_info = verify_map[task]
-        function_info = task_info['function_info']
-        
-        # 检查是否有异常
-        if isinstance(verified_sql, Exception):
-            function_info['verified_sql'] = task_info['original_sql']
-        else:
-            function_info['verified_sql'] = verified_sql
-    
-    result_dict_phase3 = {}
-    for function_info in all_functions:
-        function_name = function_info['function_name']
-        result_dict_phase3[function_name] = function_info
-    
-    
-    # 格式化SQL语句
-    print("开始格式化SQL语句")
-    format_tasks = []
-    format_map = {}
+            pending_functions.append(function_info)
+    if finished:
+        print(f"从检查点恢复 {len(all_functions) - len(pending_functions)} 个已完成的函数")
+
+    # 为所有ORM代码生成SQL语句，每个函数依次完成生成、验证、格式化三个阶段，
+    # 各函数之间并发执行，不必等待所有函数完成上一阶段
+    print("开始为所有ORM代码生成SQL语句")
+    function_tasks = [process_function_async(function_info, semaphore, fused) for function_info in pending_functions]
     
-    for i, verified_sql in enumerate(verify_results):
-        if i >= len(verify_tasks):
-            continue
-            
-        task = verify_tasks[i]
-        task_info = verify_map[task]
-        function_info = task_info['function_info']
-        function_name = function_info['function_name']
-        
-        # 检查是否有异常
-        if isinstance(verified_sql, Exception):
-            print(f"验证任务 {function_name} 失败: {verified_sql}")
-            verified_sql = task_info['original_sql']  # 使用原始SQL
-        else:
-            print(f"验证任务 {function_name} 完成，开始格式化")
-        
-        # 创建格式化任务
-        format_task = asyncio.create_task(format_sql_async(verified_sql, semaphore))
-        format_tasks.append(format_task)
-        format_map[format_task] = {
-            'function_info': function_info,
-            'verified_sql': verified_sql
-        }
-    
-    # 并发等待所有格式化任务完成
-    if format_tasks:
-        print(f"等待所有 {len(format_tasks)} 个格式化任务完成...")
-        format_results = await asyncio.gather(*format_tasks, return_exceptions=True)
-    else:
-        format_results = []
+    # 按完成顺序处理结果，完成一个写入一个；用进度条代替逐个函数的打印
+    if function_tasks:
+        print(f"等待所有 {len(function_tasks)} 个函数的处理任务完成...")
+        with open(checkpoint_file, 'ab') as checkpoint, tqdm(total=len(function_tasks), desc="处理函数") as progress:
+            for future in asyncio.as_completed(function_tasks):
+                progress.update(1)
+                try:
+                    function_info = await future
+                except Exception as e:
+                    print(f"处理函数失败: {e}")
+                    continue
+                # 只记录完整走完流程的函数。SQL生成请求失败的函数在process_function_async中
+                # 不会得到sql_statement_list，不写入检查点，下次运行时重试
+                if 'sql_statement_list' in function_info:
+                    append_checkpoint_record(checkpoint, function_info)
     
 
-    for i, sql_list in enumerate(format_results):
-        if i >= len(format_tasks):
-            continue
-            
-        task = format_tasks[i]
-        task_info = format_map[task]
-        function_info = task_info['function_info']
-        function_name = function_info['function_name']
-        
-        # 检查是否有异常
-        if isinstance(sql_list, Exception):
-            print(f"格式化任务 {function_name} 失败: {sql_list}")
-            verified_sql = task_info['verified_sql']
-            sql_list = extract_sql_statements(verified_sql)
-        else:
-            print(f"格式化任务 {function_name} 完成")
-        
-        # 如果sql_list仍然是格式不正确的字符串，尝试修复
-        if isinstance(sql_list, str):
-            sql_list = fix_malformed_json_array(sql_list)
-        
-        # 验证SQL语句完整性
-        sql_list = validate_sql_completeness(sql_list)
-        
-        # 将SQL语句列表添加到函数信息中
-        function_info['sql_statement_list'] = sql_list
-        
-        # 添加SQL类型分类
-        sql_types = []
-        for sql in sql_list:
-            sql_types.append(classify_sql(sql))
-        function_info['sql_types'] = sql_types
-        
-
     # 处理未进入格式化阶段的函数
-    for task, function_info in function_info_map.items():
+    for function_info in all_functions:
         if 'sql_statement' in function_info and 'sql_statement_list' not in function_info:
             # 这些是由于初始请求失败而跳过验证的函数
             function_info['sql_statement_list'] = [function_info['sql_statement']]
@@ -556,24 +622,27 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
                 function_info['sql_length_match'] = True
     
     # 将结果写入输出文件
-    result_dict = {}
-    for function_info in all_functions:
-        function_name = function_info['function_name']
-        result_dict[function_name] = function_info
-    
-    # 检查输入文件格式，决定输出格式
-    with open(input_file, 'r', encoding='utf-8') as file:
-        input_data = json.load(file)
-    
-    # 如果输入是列表格式，输出也用列表格式
-    if isinstance(input_data, list):
-        output_data = list(result_dict.values())
+    if jsonl:
+        # JSON Lines格式：每个函数的结果单独成行，逐条写出
+        dump_jsonl_file(all_functions, output_file)
     else:
-        # 如果输入是字典格式，输出也用字典格式
-        output_data = result_dict
+        result_dict = {}
+        for function_info in all_functions:
+            function_name = function_info['function_name']
+            result_dict[function_name] = function_info
+        
+        # 如果输入是列表格式，输出也用列表格式（按开头已解析的数据判断，无需重新读取输入文件）
+        if isinstance(data, list):
+            output_data = list(result_dict.values())
+        else:
+            # 如果输入是字典格式，输出也用字典格式
+            output_data = result_dict
+        
+        dump_json_file(output_data, output_file)
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    # 结果已完整写出，不再需要检查点
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
     
     print(f"处理完成，已将结果保存到 {output_file}")
     
@@ -585,43 +654,20 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
                 sql_type_counts[sql_type] += 1
     
     print(f"SQL类型统计: {sql_type_counts}")
+    print(f"LLM响应缓存: 命中 {LLM_CACHE_STATS['hits']} 次, 未命中 {LLM_CACHE_STATS['misses']} 次")
+    
+    # 保存LLM响应缓存
+    save_llm_cache(cache_file)
     
     return valid_count, invalid_count
 
 
 
-def process_json_file(input_file, output_file, concurrency=80):
+def process_json_file(input_file, output_file, concurrency=80, cache_file=None,
+                      max_requests_per_min=None, max_tokens_per_min=None, fused=False, jsonl=False):
     """同步版本的处理函数"""
-    return asyncio.run(process_json_file_async(input_file, output_file, concurrency))
-
-# 添加输入验证
-def validate_input_file(input_file):
-    try:
-        with open(input_file, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        # 验证必要字段
-        if isinstance(data, dict):
-            # 如果是字典类型，按原来的方式处理
-            for function_name, function_info in data.items():
-                if 'code_value' not in function_info:
-                    print(f"警告: {function_name} 缺少 code_value 字段")
-        elif isinstance(data, list):
-            # 如果是列表类型，检查每个元素是否包含必要字段
-            for i, function_info in enumerate(data):
-                if not isinstance(function_info, dict):
-                    print(f"警告: 索引 {i} 处的元素不是字典类型")
-                    continue
-                if 'code_value' not in function_info:
-                    print(f"警告: 索引 {i} 处的元素缺少 code_value 字段")
-        else:
-            print(f"警告: 输入文件格式不是字典或列表类型，而是 {type(data)}")
-            return False
-            
-        return True
-    except Exception as e:
-        print(f"输入文件验证失败: {e}")
-        return False
+    return asyncio.run(process_json_file_async(input_file, output_file, concurrency, cache_file,
+                                               max_requests_per_min, max_tokens_per_min, fused, jsonl))
 
 # 添加SQL分类功能
 def classify_sql(sql_statement):
@@ -632,86 +678,234 @@ def classify_sql(sql_statement):
             return "PARAM_DEPENDENT"
         # 尝试从字典中获取第一个SQL语句进行分类
         if "sql" in sql_statement and isinstance(sql_statement["sql"], str):
-            sql_lower = sql_statement["sql"].lower().strip()
+            sql = sql_statement["sql"]
         elif "variants" in sql_statement and len(sql_statement["variants"]) > 0:
             # 使用第一个变体的SQL进行分类
             first_variant = sql_statement["variants"][0]
             if "sql" in first_variant and isinstance(first_variant["sql"], str):
-                sql_lower = first_variant["sql"].lower().strip()
+                sql = first_variant["sql"]
             else:
                 return "OTHER"
         else:
             return "OTHER"
     elif isinstance(sql_statement, str):
-        # 原始的字符串处理逻辑
-        sql_lower = sql_statement.lower().strip()
+        sql = sql_statement
     else:
         # 处理其他类型
         return "OTHER"
     
-    # 分类逻辑
-    if sql_lower.startswith("select"):
-        return "SELECT"
-    elif sql_lower.startswith("insert"):
-        return "INSERT"
-    elif sql_lower.startswith("update"):
-        return "UPDATE"
-    elif sql_lower.startswith("delete"):
-        return "DELETE"
-    else:
-        return "OTHER"
+    # 分类逻辑：直接在原字符串上匹配开头的关键字，无需生成小写副本
+    match = SQL_TYPE_PATTERN.match(sql)
+    return match.group(1).upper() if match else "OTHER"
+
+# LLM请求参数
+LLM_MODEL = "default"
+# 提取、验证、格式化都不需要多样性，使用贪心解码，输出稳定，也使响应缓存的结果可以复用
+LLM_TEMPERATURE = 0.0
+# 单次请求生成token数的上限
+LLM_MAX_TOKENS = 8096
+
+# 连接池大小，需不小于并发请求数，否则超出部分的请求要排队等待连接或反复新建连接
+LLM_MAX_CONNECTIONS = 256
+
+# 所有请求共用一个客户端，复用其连接池中的长连接
+LLM_CLIENT = openai.AsyncClient(
+    base_url="http://62.234.167.136:8081/v1",
+    api_key="EMPTY",
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        timeout=httpx.Timeout(600.0, connect=10.0)
+    )
+)
+
+# LLM响应缓存：以请求内容的SHA256摘要为键缓存响应文本，相同的请求只发送一次
+LLM_RESPONSE_CACHE = {}
+# 进行中的请求，相同请求并发到达时等待同一个请求的结果
+LLM_PENDING_REQUESTS = {}
+LLM_CACHE_STATS = {"hits": 0, "misses": 0}
+
+def normalize_prompt(prompt):
+    """去除提示词中代码的行注释并合并空白，仅注释或缩进不同的代码得到相同的结果"""
+    return ' '.join(GO_LINE_COMMENT_PATTERN.sub('', prompt).split())
+
+def llm_cache_key(system_prompt, prompt, max_tokens):
+    """根据模型、系统提示词、规范化后的用户提示词、温度和生成上限计算缓存键"""
+    payload = json.dumps(
+        {"m": LLM_MODEL, "s": system_prompt, "u": normalize_prompt(prompt), "t": LLM_TEMPERATURE, "mt": max_tokens},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_llm_cache(cache_file):
+    """从文件加载LLM响应缓存，文件不存在时忽略"""
+    if not cache_file or not os.path.exists(cache_file):
+        return
+    try:
+        # 忽略旧缓存文件中可能存在的空响应
+        LLM_RESPONSE_CACHE.update(
+            (key, content) for key, content in load_json_file(cache_file).items()
+            if isinstance(content, str) and content
+        )
+        print(f"已加载 {len(LLM_RESPONSE_CACHE)} 条LLM响应缓存")
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"加载LLM响应缓存失败: {e}")
+
+def save_llm_cache(cache_file):
+    """将LLM响应缓存写入文件"""
+    if not cache_file:
+        return
+    with open(cache_file, 'w', encoding='utf-8') as file:
+        json.dump(LLM_RESPONSE_CACHE, file, ensure_ascii=False)
+
+class RateLimiter:
+    """按分钟限制请求数与token数的令牌桶，额度随时间连续补充，上限为每分钟的配额"""
+
+    def __init__(self, max_requests_per_min=None, max_tokens_per_min=None):
+        self.max_requests_per_min = max_requests_per_min
+        self.max_tokens_per_min = max_tokens_per_min
+        self.requests_remaining = max_requests_per_min or 0
+        self.tokens_remaining = max_tokens_per_min or 0
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        """按距上次补充经过的时间补充额度"""
+        now = time.monotonic()
+        elapsed_min = (now - self.last_refill) / 60
+        self.last_refill = now
+        if self.max_requests_per_min:
+            self.requests_remaining = min(self.max_requests_per_min,
+                                          self.requests_remaining + elapsed_min * self.max_requests_per_min)
+        if self.max_tokens_per_min:
+            self.tokens_remaining = min(self.max_tokens_per_min,
+                                        self.tokens_remaining + elapsed_min * self.max_tokens_per_min)
+
+    async def acquire(self, est_tokens):
+        """等待直到额度足够发送一个约含est_tokens个token的请求，并扣除相应额度"""
+        if self.max_tokens_per_min:
+            est_tokens = min(est_tokens, self.max_tokens_per_min)
+        # 加锁使等待的请求按到达顺序依次获得额度
+        async with self.lock:
+            while True:
+                self.refill()
+                wait_min = 0
+                if self.max_requests_per_min and self.requests_remaining < 1:
+                    wait_min = (1 - self.requests_remaining) / self.max_requests_per_min
+                if self.max_tokens_per_min and self.tokens_remaining < est_tokens:
+                    wait_min = max(wait_min, (est_tokens - self.tokens_remaining) / self.max_tokens_per_min)
+                if wait_min <= 0:
+                    break
+                await asyncio.sleep(wait_min * 60)
+            self.requests_remaining -= 1
+            self.tokens_remaining -= est_tokens
+
+# 请求速率限制器，由process_json_file_async按参数创建，为None时不限速
+LLM_RATE_LIMITER = None
+
+# 重试等待的基准时长与上限（秒）
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 60
+
+def is_retryable_error(error):
+    """判断请求错误是否值得重试：限流、服务端错误与连接错误可重试，其余4xx错误重试也不会成功"""
+    if isinstance(error, (openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return not isinstance(error, openai.APIStatusError)
+
+def retry_delay(retry_count, error):
+    """计算第retry_count次重试前的等待时长：指数退避加全抖动，服务端返回Retry-After时至少等待该时长"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retry_count))
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get('retry-after')))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+def max_tokens_for_sql_count(sql_pattern_cnt):
+    """按预期的SQL语句数估算生成与验证阶段所需的max_tokens，数量未知时使用上限"""
+    if not isinstance(sql_pattern_cnt, int) or sql_pattern_cnt <= 0:
+        return LLM_MAX_TOKENS
+    # 每条SQL语句（含变体与说明）约需1024个token，另留2048个token给分析文字
+    return min(LLM_MAX_TOKENS, 2048 + 1024 * sql_pattern_cnt)
+
+def max_tokens_for_format(sql_statement):
+    """按待格式化内容的长度估算格式化阶段所需的max_tokens"""
+    # 格式化结果不会比输入更长，按每2个字符1个token估算并留出余量
+    return min(LLM_MAX_TOKENS, len(sql_statement) // 2 + 1024)
+
+async def chat_completion_async(system_prompt, prompt, max_tokens=LLM_MAX_TOKENS):
+    """发送聊天请求并返回响应文本，命中缓存时不再请求"""
+    key = llm_cache_key(system_prompt, prompt, max_tokens)
+    while True:
+        if key in LLM_RESPONSE_CACHE:
+            LLM_CACHE_STATS['hits'] += 1
+            return LLM_RESPONSE_CACHE[key]
+        pending = LLM_PENDING_REQUESTS.get(key)
+        if pending is None:
+            break
+        # 相同请求正在进行中，等待其完成后从缓存读取；若该请求失败则由当前调用重新发送
+        await pending
+
+    LLM_CACHE_STATS['misses'] += 1
+    # 先登记进行中的请求再等待限流，等待期间到达的相同请求会复用本次结果，不会重复发送
+    pending = asyncio.get_running_loop().create_future()
+    LLM_PENDING_REQUESTS[key] = pending
+    try:
+        if LLM_RATE_LIMITER:
+            # 提示词以中文为主，粗略按每2个字符1个token估算
+            await LLM_RATE_LIMITER.acquire((len(system_prompt) + len(prompt)) // 2)
+        response = await LLM_CLIENT.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=LLM_TEMPERATURE,
+            max_tokens=max_tokens,
+        )
+        content = response.choices[0].message.content
+        # 只缓存非空的文本响应。内容为空（None或空字符串）时不缓存，
+        # 调用方重试时会重新发送请求，而不是反复读到同一个空响应
+        if isinstance(content, str) and content:
+            LLM_RESPONSE_CACHE[key] = content
+        return content
+    finally:
+        del LLM_PENDING_REQUESTS[key]
+        pending.set_result(None)
 
 # 添加缺失的函数
-async def send_request_async(question, semaphore):
+async def send_request_async(question, semaphore, max_tokens=LLM_MAX_TOKENS):
+    """发送SQL生成请求并返回响应文本，重试耗尽或遇到不可重试的错误时抛出最后一次的异常"""
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://62.234.167.136:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         max_retries = 3
         retry_count = 0
         
-        while retry_count < max_retries:
+        while True:
             try:
-                response = await client.chat.completions.create(
-                    model="default",
-                    messages=[
-                        {"role": "system", "content": ""},
-                        {"role": "user", "content": question},
-                    ],
-                    temperature=0.7,
-                    max_tokens=8096,
-                )
-                return response.choices[0].message.content
+                content = await chat_completion_async("", question, max_tokens)
+                return content
             except Exception as e:
+                if not is_retryable_error(e):
+                    logger.warning("请求出错且不可重试: %s", e)
+                    raise
                 retry_count += 1
-                print(f"{question[:50]}... 重试 {retry_count}/{max_retries}, 错误: {e}")
-                await asyncio.sleep(1)
-        
-        # 如果所有重试都失败，返回错误信息
-        return f"请求失败: {question[:50]}..."
+                logger.warning("%s... 重试 %s/%s, 错误: %s", question[:50], retry_count, max_retries, e)
+                # 所有重试都失败时抛出异常，由调用方按请求失败处理，
+                # 不能返回错误信息文本，否则会被当作生成结果继续验证、格式化并写入检查点
+                if retry_count >= max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(retry_count, e))
 
-async def verify_sql_async(sql_statement, function_definition=None, code_meta_data=None, caller=None, semaphore=None, sql_pattern_cnt=None):
+async def verify_sql_async(sql_statement, function_definition=None, code_chain=None, caller=None, semaphore=None, sql_pattern_cnt=None):
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://62.234.167.136:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         # 构建提示词，使用CODE_ORM_MYSQL_SQL_VERIFY模板
-        code_chain = ""
-        if code_meta_data and len(code_meta_data) > 0:
-            for meta in code_meta_data:
-                if isinstance(meta, str):
-                    code_chain += f"{meta}\n"
-                elif isinstance(meta, dict) and 'code_value' in meta:
-                    code_chain += f"{meta.get('code_value', '')}\n"
-        
-        prompt = CODE_ORM_MYSQL_SQL_VERIFY.format(
+        prompt = VERIFY_PROMPT_PREFIX + VERIFY_PROMPT_SUFFIX.format(
             function_definition=function_definition if function_definition else "",
             caller=caller if caller else "",
-            code_chain=code_chain,
+            code_chain=code_chain if code_chain else "",
             sql_statement=sql_statement,
             sql_pattern_cnt=sql_pattern_cnt if sql_pattern_cnt is not None else ""
         )
@@ -721,34 +915,36 @@ async def verify_sql_async(sql_statement, function_definition=None, code_meta_da
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
-                    model="default",
-                    messages=[
-                        {"role": "system", "content": "你是一个SQL专家，擅长分析和修正SQL语句。"},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.7,
-                    max_tokens=8096,
-                )
-                return response.choices[0].message.content
+                content = await chat_completion_async("你是一个SQL专家，擅长分析和修正SQL语句。", prompt,
+                                                   max_tokens_for_sql_count(sql_pattern_cnt))
+                return content
             except Exception as e:
+                if not is_retryable_error(e):
+                    logger.warning("请求出错且不可重试: %s", e)
+                    break
                 retry_count += 1
-                print(f"验证SQL时出错，正在重试 {retry_count}/{max_retries}: {e}")
-                await asyncio.sleep(1)
+                logger.warning("验证SQL时出错，正在重试 %s/%s: %s", retry_count, max_retries, e)
+                if retry_count < max_retries:
+                    await asyncio.sleep(retry_delay(retry_count, e))
         
         # 如果所有重试都失败，返回原始SQL
-        print(f"验证SQL失败，返回原始SQL")
+        logger.warning("验证SQL失败，返回原始SQL")
         return sql_statement
 
+def split_sql_statements(text):
+    """按分号切分SQL文本，去掉空白片段并为每条语句补回结尾的分号"""
+    # 按分号切分后的片段不会再以分号结尾，补回的分号不会重复，无需再检查末尾的';;'
+    statements = []
+    for stmt in text.split(';'):
+        stmt = stmt.strip()
+        if stmt:
+            statements.append(sys.intern(stmt + ';'))
+    return statements
+
 async def format_sql_async(sql_statement, semaphore):
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://62.234.167.136:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         # 构建提示词，使用CODE_ORM_MYSQL_SQL_FORMAT模板
-        prompt = CODE_ORM_MYSQL_SQL_FORMAT.format(
+        prompt = FORMAT_PROMPT_PREFIX + FORMAT_PROMPT_SUFFIX.format(
             sql_statement=sql_statement
         )
         
@@ -757,99 +953,74 @@ async def format_sql_async(sql_statement, semaphore):
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
-                    model="default",
-                    messages=[
-                        {"role": "system", "content": "你是一个SQL格式化专家，擅长将SQL语句转换为标准JSON格式。"},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.7,
-                    max_tokens=8096,
-                )
+                content = await chat_completion_async("你是一个SQL格式化专家，擅长将SQL语句转换为标准JSON格式。", prompt,
+                                                   max_tokens_for_format(sql_statement))
                 
                 # 尝试解析响应为JSON数组
-                formatted_response = response.choices[0].message.content.strip()
+                formatted_response = content.strip()
                 try:
                     # 检查是否包含```json标记
                     if "```json" in formatted_response:
                         # 提取json部分
-                        match = re.search(r'```json\s*([\s\S]*?)```', formatted_response)
+                        match = JSON_CODE_BLOCK_PATTERN.search(formatted_response)
                         if match:
                             json_content = match.group(1).strip()
                             # 解析提取出的json内容
-                            sql_list = json.loads(json_content)
+                            sql_list = json_loads(json_content)
                             return sql_list
                     
-                    # 检查是否已经是JSON数组格式
-                    if formatted_response.startswith('[') and formatted_response.endswith(']'):
-                        sql_list = json.loads(formatted_response)
+                    # 检查是否已经是JSON数组格式（响应已去除首尾空白，直接比较首尾字符）
+                    if formatted_response and formatted_response[0] == '[' and formatted_response[-1] == ']':
+                        sql_list = json_loads(formatted_response)
                         return sql_list
                     else:
                         # 尝试分割SQL语句
-                        sql_statements = [stmt.strip() for stmt in formatted_response.split(';') if stmt.strip()]
-                        sql_statements = [f"{stmt};" for stmt in sql_statements]
-                        # 移除最后一个语句末尾多余的分号
-                        if sql_statements and sql_statements[-1].endswith(';;'):
-                            sql_statements[-1] = sql_statements[-1][:-1]
-                        return sql_statements
+                        return split_sql_statements(formatted_response)
                 except json.JSONDecodeError:
                     # 如果不是有效的JSON，尝试分割SQL语句
-                    sql_statements = [stmt.strip() for stmt in formatted_response.split(';') if stmt.strip()]
-                    sql_statements = [f"{stmt};" for stmt in sql_statements]
-                    # 移除最后一个语句末尾多余的分号
-                    if sql_statements and sql_statements[-1].endswith(';;'):
-                        sql_statements[-1] = sql_statements[-1][:-1]
-                    return sql_statements
+                    return split_sql_statements(formatted_response)
                 
             except Exception as e:
+                if not is_retryable_error(e):
+                    logger.warning("请求出错且不可重试: %s", e)
+                    break
                 retry_count += 1
-                print(f"格式化SQL时出错，正在重试 {retry_count}/{max_retries}: {e}")
-                await asyncio.sleep(1)
+                logger.warning("格式化SQL时出错，正在重试 %s/%s: %s", retry_count, max_retries, e)
+                if retry_count < max_retries:
+                    await asyncio.sleep(retry_delay(retry_count, e))
         
         # 如果所有重试都失败，尝试简单分割
-        print(f"格式化SQL失败，尝试简单分割")
-        sql_statements = [stmt.strip() for stmt in sql_statement.split(';') if stmt.strip()]
-        sql_statements = [f"{stmt};" for stmt in sql_statements]
-        # 移除最后一个语句末尾多余的分号
-        if sql_statements and sql_statements[-1].endswith(';;'):
-            sql_statements[-1] = sql_statements[-1][:-1]
-        return sql_statements
+        logger.warning("格式化SQL失败，尝试简单分割")
+        return split_sql_statements(sql_statement)
 
 # 添加新的函数用于验证SQL语句完整性
 def validate_sql_completeness(sql_list):
     """验证SQL语句是否完整，没有省略号或类似的占位符"""
     validated_list = []
     
-    # 尝试修复不正确的JSON格式
+    # 尝试修复不正确的JSON格式，修复结果总是列表
     if isinstance(sql_list, str):
         sql_list = fix_malformed_json_array(sql_list)
     
-    # 如果仍然是字符串，转换为列表
-    if isinstance(sql_list, str):
-        sql_list = [sql_list]
-    
     for item in sql_list:
         if isinstance(item, str):
             # 检查字符串中是否有省略号或[其他字段]类型的占位符
-            if "..." in item or "[其他" in item or "其他]" in item:
+            if PLACEHOLDER_PATTERN.search(item):
                 # 尝试修复或标记为不完整
-                print(f"发现不完整SQL语句: {item}")
+                logger.warning("发现不完整SQL语句: %s", item)
                 # 这里可以添加修复逻辑或直接标记
-                validated_list.append(f"不完整SQL语句: {item}")
+                validated_list.append(INCOMPLETE_SQL_PREFIX + item)
             else:
                 validated_list.append(item)
         elif isinstance(item, dict) and "variants" in item:
-            # 检查每个变体
-            fixed_variants = []
-            for variant in item.get("variants", []):
+            # 检查每个变体，只在发现占位符时原地改写该变体的SQL，不重建变体列表
+            for variant in item["variants"]:
                 sql = variant.get("sql", "")
-                if "..." in sql or "[其他" in sql or "其他]" in sql:
-                    print(f"发现不完整SQL变体: {sql}")
+                if PLACEHOLDER_PATTERN.search(sql):
+                    logger.warning("发现不完整SQL变体: %s", sql)
                     # 这里可以添加修复逻辑或直接标记
-                    variant["sql"] = f"不完整SQL语句: {sql}"
-                fixed_variants.append(variant)
+                    variant["sql"] = INCOMPLETE_SQL_PREFIX + sql
             
-            item["variants"] = fixed_variants
             validated_list.append(item)
         else:
             validated_list.append(item)
@@ -857,54 +1028,80 @@ def validate_sql_completeness(sql_list):
     return validated_list
 
 def fix_malformed_json_array(json_str):
-    """修复格式不正确的JSON数组字符串"""
-    # 如果是字符串内的JSON数组，尝试提取并解析
-    try:
-        # 尝试直接解析
-        return json.loads(json_str)
-    except json.JSONDecodeError:
-        # 如果解析失败，尝试修复常见问题
-        
-        # 检查是否是引号内的JSON字符串（如示例中的情况）
-        if json_str.startswith('"[') and json_str.endswith(']"'):
-            # 移除外层引号并转义内部引号
-            inner_json = json_str[1:-1].replace('\\"', '"')
-            try:
-                return json.loads(inner_json)
-            except json.JSONDecodeError:
-                pass
-        
-        # 检查是否有多余的转义字符
-        cleaned = json_str.replace('\\n', '\n').replace('\\"', '"')
-        if cleaned != json_str:
-            try:
-                return json.loads(cleaned)
-            except json.JSONDecodeError:
-                pass
-        
-        # 更彻底的修复尝试 - 提取所有可能的SQL语句
-        return extract_sql_statements(json_str)
+    """修复格式不正确的JSON数组字符串，总是返回列表"""
+    # 依次尝试解析：原始字符串、去掉外层引号的JSON字符串（如示例中的情况）、去除多余转义字符后的字符串
+    candidates = [json_str]
+    if json_str.startswith('"[') and json_str.endswith(']"'):
+        # 移除外层引号并转义内部引号
+        candidates.append(json_str[1:-1].replace('\\"', '"'))
+    candidates.append(json_str.replace('\\n', '\n').replace('\\"', '"'))
+    
+    # 与已尝试过的内容相同、或首字符不可能构成JSON值的候选直接跳过，
+    # 避免对LLM返回的说明文字反复抛出并捕获JSONDecodeError
+    tried = set()
+    for candidate in candidates:
+        if candidate in tried or candidate.lstrip()[:1] not in JSON_VALUE_START_CHARS:
+            continue
+        tried.add(candidate)
+        try:
+            parsed = json_loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        # 解析出的不是数组时（如单条SQL字符串或单个变体对象），作为唯一元素包装为列表
+        return parsed if isinstance(parsed, list) else [parsed]
+    
+    # 更彻底的修复尝试 - 提取所有可能的SQL语句
+    return extract_sql_statements(json_str)
 
 def extract_sql_statements(text):
-    """从文本中提取SQL语句"""
+    """从文本中提取SQL语句
+
+    说明文字中出现SQL关键字（如updated_at）时，其后的param_dependent对象仍被完整解析：
+
+    >>> extract_sql_statements('根据updated_at字段判断\\n{"type": "param_dependent", "variants": [{"sql": "SELECT * FROM t WHERE id = 1;"}, {"sql": "SELECT * FROM t WHERE id = 2;"}]}')
+    [{'type': 'param_dependent', 'variants': [{'sql': 'SELECT * FROM t WHERE id = 1;'}, {'sql': 'SELECT * FROM t WHERE id = 2;'}]}]
+    """
     # 这个函数尝试从文本中提取SQL语句，适用于LLM返回了带有说明的文本而不是纯JSON
     
-    # 尝试提取param_dependent格式的SQL
-    param_dependent_matches = re.findall(r'{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*}', text, re.DOTALL)
-    
-    # 一般性SQL语句提取
-    # 查找以SELECT、INSERT、UPDATE、DELETE等开头，以分号结尾的语句
-    sql_matches = re.findall(r'(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[\s\S]*?;', text, re.IGNORECASE)
+    # 从左到右只扫描一遍，同时提取param_dependent格式的SQL和一般性SQL语句
+    # param_dependent对象整体作为一个匹配被跳过，其内部变体的SQL不会被重复提取
+    param_dependent_matches = []
+    sql_matches = []
+    pos = 0
+    while True:
+        match = SQL_TOKEN_PATTERN.search(text, pos)
+        if not match:
+            break
+        if match.lastgroup == 'param_dependent':
+            param_dependent_matches.append(match.group())
+            pos = match.end()
+            continue
+        # 说明文字中的关键字（如updated_at、UPDATE操作）会让SQL匹配一直延伸到对象内部的第一个分号，
+        # 此时丢弃这段匹配，从对象开头重新扫描，使对象能作为param_dependent被完整匹配
+        opener = PARAM_DEPENDENT_START_PATTERN.search(text, match.start(), match.end())
+        if opener:
+            pos = opener.start()
+            continue
+        sql_matches.append(match.group())
+        pos = match.end()
     
     # 合并结果
     result = []
     
+    # 已添加变体SQL的规范化形式，只在解析param_dependent时构建一次
+    variant_sqls = set()
+    
     # 添加param_dependent类型
     for match in param_dependent_matches:
         try:
             # 尝试将提取的内容解析为JSON
-            parsed = json.loads(match)
+            parsed = json_loads(match)
             result.append(parsed)
+            variant_sqls.update(
+                normalize_sql(variant['sql'])
+                for variant in parsed.get('variants', [])
+                if isinstance(variant, dict) and isinstance(variant.get('sql'), str)
+            )
         except json.JSONDecodeError:
             # 如果解析失败，将其作为字符串添加
             result.append(match)
@@ -912,25 +1109,28 @@ def extract_sql_statements(text):
     # 添加常规SQL语句
     for match in sql_matches:
         # 检查是否已经作为param_dependent的一部分添加
-        already_added = False
-        for item in result:
-            if isinstance(item, dict) and 'variants' in item:
-                for variant in item['variants']:
-                    if match in variant.get('sql', ''):
-                        already_added = True
-                        break
-        
-        if not already_added:
-            result.append(match)
+        # 对每条语句做一次集合查找，代替逐个遍历所有变体的子串查找
+        if normalize_sql(match) not in variant_sqls:
+            # LLM经常重复输出相同的SQL，驻留后相同语句共享同一个字符串对象，
+            # 后续比较可以直接命中身份相等的快速路径
+            result.append(sys.intern(match))
     
     # 如果没有找到任何SQL语句，将原始文本分割为语句
     if not result:
         statements = [stmt.strip() for stmt in text.split(';') if stmt.strip()]
-        statements = [f"{stmt};" for stmt in statements if not stmt.startswith('{') and not stmt.startswith('[')]
+        statements = [sys.intern(f"{stmt};") for stmt in statements if not stmt.startswith('{') and not stmt.startswith('[')]
         result.extend(statements)
     
     return result
 
+@lru_cache(maxsize=65536)
+def normalize_sql(sql):
+    """将SQL语句规范化为用于比较的形式：合并空白、去除末尾分号并转为小写"""
+    # 同一条SQL会在去重时与多条SQL反复比较，缓存规范化结果避免重复计算
+    # split()/join()在C层完成空白合并与首尾去除，与re.sub(r'\s+', ' ', sql).strip()结果一致
+    # 规范化结果同样驻留，不同原文规范化后相同的SQL共享同一个字符串对象
+    return sys.intern(' '.join(sql.split()).rstrip(';').lower())
+
 # 添加函数用于比较两个SQL语句是否重复
 def compare_sql_statements(sql1, sql2):
     """比较两个SQL语句是否实质上相同"""
@@ -938,53 +1138,50 @@ def compare_sql_statements(sql1, sql2):
     if sql1 == sql2:
         return True
     
-    # 如果一个是字符串，一个是字典，它们不相同
-    if (isinstance(sql1, str) and isinstance(sql2, dict)) or \
-       (isinstance(sql1, dict) and isinstance(sql2, str)):
+    # 每个参数只做一次类型判断
+    if isinstance(sql1, str):
+        # 如果一个是字符串，另一个不是，它们不相同
+        if not isinstance(sql2, str):
+            return False
+        # 如果都是字符串，移除空格、换行和分号进行简化比较
+        return normalize_sql(sql1) == normalize_sql(sql2)
+    
+    # 只有都是字典（变体SQL）时才需要继续比较
+    if not (isinstance(sql1, dict) and isinstance(sql2, dict)):
         return False
     
-    # 如果都是字符串，进行简化比较
-    if isinstance(sql1, str) and isinstance(sql2, str):
-        # 移除空格、换行和分号进行比较
-        simplified1 = re.sub(r'\s+', ' ', sql1).strip().rstrip(';').lower()
-        simplified2 = re.sub(r'\s+', ' ', sql2).strip().rstrip(';').lower()
-        return simplified1 == simplified2
-    
-    # 如果都是字典（变体SQL）
-    if isinstance(sql1, dict) and isinstance(sql2, dict):
-        # 如果类型不同
-        if sql1.get('type') != sql2.get('type'):
-            return False
-        
-        # 比较变体数量
-        variants1 = sql1.get('variants', [])
-        variants2 = sql2.get('variants', [])
-        
-        if len(variants1) != len(variants2):
-            return False
-        
-        # 简单检查：检查是否有相同数量的变体具有相同的SQL
-        sql_set1 = set()
-        for variant in variants1:
-            if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
-                sql_set1.add(simplified)
-        
-        sql_set2 = set()
-        for variant in variants2:
-            if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
-                sql_set2.add(simplified)
-        
-        # 如果两个集合有重叠，认为它们可能是相同的SQL
-        return len(sql_set1.intersection(sql_set2)) > 0
+    # 如果类型不同
+    if sql1.get('type') != sql2.get('type'):
+        return False
+    
+    # 比较变体数量
+    variants1 = sql1.get('variants', [])
+    variants2 = sql2.get('variants', [])
+    
+    if len(variants1) != len(variants2):
+        return False
     
-    return False
+    # 简单检查：检查是否有相同数量的变体具有相同的SQL
+    sql_set1 = {normalize_sql(variant['sql']) for variant in variants1 if 'sql' in variant}
+    sql_set2 = {normalize_sql(variant['sql']) for variant in variants2 if 'sql' in variant}
+    
+    # 如果两个集合有重叠，认为它们可能是相同的SQL
+    # isdisjoint在找到第一个公共元素时即返回，无需构造完整交集
+    return not sql_set1.isdisjoint(sql_set2)
 
 if __name__ == '__main__':
     # 导入必要的库
     import argparse
     
+    # 设置日志
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    
     # 配置文件路径
     input_file = '/data/local_disk0/shawn/api_benchmark/cos/5-22-cos.json'
     output_file = '/data/local_disk0/shawn/api_benchmark/cos/cos_results_529_1644.json'
@@ -995,13 +1192,23 @@ if __name__ == '__main__':
     parser.add_argument('--input', type=str, default=input_file, help='输入JSON文件路径')
     parser.add_argument('--output', type=str, default=output_file, help='输出JSON文件路径')
     parser.add_argument('--concurrency', type=int, default=80, help='并发请求数量')
+    parser.add_argument('--cache-file', type=str, default=None, help='LLM响应缓存文件路径，不指定时只在本次运行内缓存')
+    parser.add_argument('--max-requests-per-min', type=int, default=None, help='每分钟最多发出的请求数，不指定时不限制')
+    parser.add_argument('--max-tokens-per-min', type=int, default=None, help='每分钟最多发出的提示词token数（估算），不指定时不限制')
+    parser.add_argument('--fused', action='store_true', help='每个函数先用一次请求直接生成JSON格式的SQL语句，解析失败时再进行验证与格式化')
+    parser.add_argument('--jsonl', action='store_true', help='以JSON Lines格式输出，每行一个函数的结果')
     args = parser.parse_args()
     
     # 处理JSON文件
     valid_count, invalid_count = process_json_file(
         args.input, 
         args.output, 
-        args.concurrency
+        args.concurrency,
+        args.cache_file,
+        args.max_requests_per_min,
+        args.max_tokens_per_min,
+        args.fused,
+        args.jsonl
     )
     
     print(f"统计结果: 有效ORM {valid_count}个, 无效ORM {invalid_count}个")
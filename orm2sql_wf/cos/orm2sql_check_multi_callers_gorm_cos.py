@@ -4,11 +4,44 @@ import asyncio
 import openai
 import argparse
 import re
+import sys
+import logging
 from tqdm import tqdm
 import time
 import base64
 from mimetypes import guess_type
+from functools import lru_cache
 
+# 优先使用orjson读写JSON，未安装时回退到标准库json
+# orjson.JSONDecodeError是json.JSONDecodeError的子类，原有的异常处理无需修改
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads
+
+# 重试、不完整SQL等逐条出现的诊断信息通过日志输出，消息在日志级别允许时才格式化
+logger = logging.getLogger(__name__)
+
+# 模块中用到的正则表达式统一在此预编译，各函数直接复用
+# LLM响应中```json代码块的内容
+JSON_CODE_BLOCK_PATTERN = re.compile(r'```json\s*([\s\S]*?)```')
+# 单次扫描LLM输出所用的模式：param_dependent格式的SQL变体对象，或以SELECT、INSERT等关键字开头、以分号结尾的SQL语句
+# 使用[^;]*代替非贪婪的[\s\S]*?，匹配范围相同，但无需在每个字符处尝试匹配结尾
+SQL_TOKEN_PATTERN = re.compile(
+    r'(?P<param_dependent>{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*})'
+    r'|(?P<sql>(?i:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[^;]*;)',
+    re.DOTALL
+)
+# param_dependent格式SQL对象的开头，用于检查一条SQL匹配是否越过了对象开头
+PARAM_DEPENDENT_START_PATTERN = re.compile(r'{\s*"type"\s*:\s*"param_dependent"')
+# SQL中的省略号或[其他字段]类型的占位符，一次扫描代替三次子串查找
+PLACEHOLDER_PATTERN = re.compile(r'\.\.\.|\[其他|其他\]')
+# 含占位符的SQL被标记为不完整时添加的前缀，下游可用startswith判断
+INCOMPLETE_SQL_PREFIX = "不完整SQL语句: "
+# JSON值可能的首字符（数组、对象、字符串、数字、true/false/null）
+JSON_VALUE_START_CHARS = frozenset('[{"-0123456789tfn')
 
 CODE_ORM_MYSQL_SQL_EXTRACT = \
     "这是一段基于gorm框架的ORM代码。gorm是Go语言的优秀ORM库，支持模型关联、事务处理、钩子方法、自动迁移、自定义类型等多种功能。" \
@@ -216,18 +249,47 @@ CODE_ORM_MYSQL_SQL_FORMAT = \
 
 
 
+def load_json_file(path):
+    """读取并解析JSON文件"""
+    # 以二进制方式一次性读入，交给解析器直接处理UTF-8字节，省去文本层的逐块解码
+    with open(path, 'rb') as file:
+        return json_loads(file.read())
+
+def dump_json_file(data, path):
+    """将数据以缩进2格、保留非ASCII字符的格式写入JSON文件"""
+    if orjson:
+        # orjson在C中完成序列化，一次写出全部字节
+        with open(path, 'wb') as file:
+            file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+
+def dump_jsonl_file(records, path):
+    """将记录逐条写入JSON Lines文件，每行一条记录"""
+    # 逐条序列化后立即写出，不在内存中拼接整份输出
+    if orjson:
+        with open(path, 'wb', buffering=1 << 20) as file:
+            for record in records:
+                file.write(orjson.dumps(record))
+                file.write(b'\n')
+    else:
+        with open(path, 'w', encoding='utf-8', buffering=1 << 20) as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False))
+                file.write('\n')
+
+async def process_json_file_async(input_file, output_file, concurrency=80, jsonl=False):
+    """处理JSON文件并将结果保存到单个文件中，包含SQL语句
 
-async def process_json_file_async(input_file, output_file, concurrency=80):
-    """处理JSON文件并将结果保存到单个文件中，包含SQL语句"""
-    # 验证输入文件
-    if not validate_input_file(input_file):
+    jsonl为True时按JSON Lines格式输出，每行一个函数的结果
+    """
+    # 读取并验证输入文件，整个处理过程只解析一次
+    data = validate_input_file(input_file)
+    if data is None:
         print("输入文件验证失败，终止处理")
         return 0, 0
     
-    # 读取输入文件
-    with open(input_file, 'r', encoding='utf-8') as file:
-        data = json.load(file)
-    
     # 创建信号量控制并发请求数
     semaphore = asyncio.Semaphore(concurrency)
     
@@ -486,24 +548,23 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
             function_info['caller_results'].append(caller_result)
     
     # 将结果写入输出文件
-    result_dict = {}
-    for function_info in all_functions:
-        function_name = function_info['function_name']
-        result_dict[function_name] = function_info
-    
-    # 检查输入文件格式，决定输出格式
-    with open(input_file, 'r', encoding='utf-8') as file:
-        input_data = json.load(file)
-    
-    # 如果输入是列表格式，输出也用列表格式
-    if isinstance(input_data, list):
-        output_data = list(result_dict.values())
+    if jsonl:
+        # JSON Lines格式：每个函数的结果单独成行，逐条写出
+        dump_jsonl_file(all_functions, output_file)
     else:
-        # 如果输入是字典格式，输出也用字典格式
-        output_data = result_dict
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+        result_dict = {}
+        for function_info in all_functions:
+            function_name = function_info['function_name']
+            result_dict[function_name] = function_info
+        
+        # 如果输入是列表格式，输出也用列表格式（按开头已解析的数据判断，无需重新读取输入文件）
+        if isinstance(data, list):
+            output_data = list(result_dict.values())
+        else:
+            # 如果输入是字典格式，输出也用字典格式
+            output_data = result_dict
+        
+        dump_json_file(output_data, output_file)
     
     print(f"处理完成，已将结果保存到 {output_file}")
     
@@ -527,15 +588,15 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
 
 
 
-def process_json_file(input_file, output_file, concurrency=80):
+def process_json_file(input_file, output_file, concurrency=80, jsonl=False):
     """同步版本的处理函数"""
-    return asyncio.run(process_json_file_async(input_file, output_file, concurrency))
+    return asyncio.run(process_json_file_async(input_file, output_file, concurrency, jsonl))
 
 # 添加输入验证
 def validate_input_file(input_file):
+    """读取并验证输入文件，验证通过时返回解析后的数据，否则返回None"""
     try:
-        with open(input_file, 'r', encoding='utf-8') as file:
-            data = json.load(file)
+        data = load_json_file(input_file)
         
         # 验证必要字段
         if isinstance(data, dict):
@@ -553,12 +614,12 @@ def validate_input_file(input_file):
                     print(f"警告: 索引 {i} 处的元素缺少 code_value 字段")
         else:
             print(f"警告: 输入文件格式不是字典或列表类型，而是 {type(data)}")
-            return False
+            return None
             
-        return True
+        return data
     except Exception as e:
         print(f"输入文件验证失败: {e}")
-        return False
+        return None
 
 # 添加SQL分类功能
 def classify_sql(sql_statement):
@@ -623,7 +684,7 @@ async def send_request_async(question, semaphore):
                 return response.choices[0].message.content
             except Exception as e:
                 retry_count += 1
-                print(f"{question[:50]}... 重试 {retry_count}/{max_retries}, 错误: {e}")
+                logger.warning("%s... 重试 %s/%s, 错误: %s", question[:50], retry_count, max_retries, e)
                 await asyncio.sleep(1)
         
         # 如果所有重试都失败，返回错误信息
@@ -670,13 +731,23 @@ async def verify_sql_async(sql_statement, code_value=None, code_meta_data=None,
                 return response.choices[0].message.content
             except Exception as e:
                 retry_count += 1
-                print(f"验证SQL时出错，正在重试 {retry_count}/{max_retries}: {e}")
+                logger.warning("验证SQL时出错，正在重试 %s/%s: %s", retry_count, max_retries, e)
                 await asyncio.sleep(1)
         
         # 如果所有重试都失败，返回原始SQL
-        print(f"验证SQL失败，返回原始SQL")
+        logger.warning("验证SQL失败，返回原始SQL")
         return sql_statement
 
+def split_sql_statements(text):
+    """按分号切分SQL文本，去掉空白片段并为每条语句补回结尾的分号"""
+    # 按分号切分后的片段不会再以分号结尾，补回的分号不会重复，无需再检查末尾的';;'
+    statements = []
+    for stmt in text.split(';'):
+        stmt = stmt.strip()
+        if stmt:
+            statements.append(sys.intern(stmt + ';'))
+    return statements
+
 async def format_sql_async(sql_statement, semaphore):
     async with semaphore:
         client = openai.AsyncClient(
@@ -710,83 +781,61 @@ async def format_sql_async(sql_statement, semaphore):
                     # 检查是否包含```json标记
                     if "```json" in formatted_response:
                         # 提取json部分
-                        match = re.search(r'```json\s*([\s\S]*?)```', formatted_response)
+                        match = JSON_CODE_BLOCK_PATTERN.search(formatted_response)
                         if match:
                             json_content = match.group(1).strip()
                             # 解析提取出的json内容
-                            sql_list = json.loads(json_content)
+                            sql_list = json_loads(json_content)
                             return sql_list
                     
-                    # 检查是否已经是JSON数组格式
-                    if formatted_response.startswith('[') and formatted_response.endswith(']'):
-                        sql_list = json.loads(formatted_response)
+                    # 检查是否已经是JSON数组格式（响应已去除首尾空白，直接比较首尾字符）
+                    if formatted_response and formatted_response[0] == '[' and formatted_response[-1] == ']':
+                        sql_list = json_loads(formatted_response)
                         return sql_list
                     else:
                         # 尝试分割SQL语句
-                        sql_statements = [stmt.strip() for stmt in formatted_response.split(';') if stmt.strip()]
-                        sql_statements = [f"{stmt};" for stmt in sql_statements]
-                        # 移除最后一个语句末尾多余的分号
-                        if sql_statements and sql_statements[-1].endswith(';;'):
-                            sql_statements[-1] = sql_statements[-1][:-1]
-                        return sql_statements
+                        return split_sql_statements(formatted_response)
                 except json.JSONDecodeError:
                     # 如果不是有效的JSON，尝试分割SQL语句
-                    sql_statements = [stmt.strip() for stmt in formatted_response.split(';') if stmt.strip()]
-                    sql_statements = [f"{stmt};" for stmt in sql_statements]
-                    # 移除最后一个语句末尾多余的分号
-                    if sql_statements and sql_statements[-1].endswith(';;'):
-                        sql_statements[-1] = sql_statements[-1][:-1]
-                    return sql_statements
+                    return split_sql_statements(formatted_response)
                 
             except Exception as e:
                 retry_count += 1
-                print(f"格式化SQL时出错，正在重试 {retry_count}/{max_retries}: {e}")
+                logger.warning("格式化SQL时出错，正在重试 %s/%s: %s", retry_count, max_retries, e)
                 await asyncio.sleep(1)
         
         # 如果所有重试都失败，尝试简单分割
-        print(f"格式化SQL失败，尝试简单分割")
-        sql_statements = [stmt.strip() for stmt in sql_statement.split(';') if stmt.strip()]
-        sql_statements = [f"{stmt};" for stmt in sql_statements]
-        # 移除最后一个语句末尾多余的分号
-        if sql_statements and sql_statements[-1].endswith(';;'):
-            sql_statements[-1] = sql_statements[-1][:-1]
-        return sql_statements
+        logger.warning("格式化SQL失败，尝试简单分割")
+        return split_sql_statements(sql_statement)
 
 # 添加新的函数用于验证SQL语句完整性
 def validate_sql_completeness(sql_list):
     """验证SQL语句是否完整，没有省略号或类似的占位符"""
     validated_list = []
     
-    # 尝试修复不正确的JSON格式
+    # 尝试修复不正确的JSON格式，修复结果总是列表
     if isinstance(sql_list, str):
         sql_list = fix_malformed_json_array(sql_list)
     
-    # 如果仍然是字符串，转换为列表
-    if isinstance(sql_list, str):
-        sql_list = [sql_list]
-    
     for item in sql_list:
         if isinstance(item, str):
             # 检查字符串中是否有省略号或[其他字段]类型的占位符
-            if "..." in item or "[其他" in item or "其他]" in item:
+            if PLACEHOLDER_PATTERN.search(item):
                 # 尝试修复或标记为不完整
-                print(f"发现不完整SQL语句: {item}")
+                logger.warning("发现不完整SQL语句: %s", item)
                 # 这里可以添加修复逻辑或直接标记
-                validated_list.append(f"不完整SQL语句: {item}")
+                validated_list.append(INCOMPLETE_SQL_PREFIX + item)
             else:
                 validated_list.append(item)
         elif isinstance(item, dict) and "variants" in item:
-            # 检查每个变体
-            fixed_variants = []
-            for variant in item.get("variants", []):
+            # 检查每个变体，只在发现占位符时原地改写该变体的SQL，不重建变体列表
+            for variant in item["variants"]:
                 sql = variant.get("sql", "")
-                if "..." in sql or "[其他" in sql or "其他]" in sql:
-                    print(f"发现不完整SQL变体: {sql}")
+                if PLACEHOLDER_PATTERN.search(sql):
+                    logger.warning("发现不完整SQL变体: %s", sql)
                     # 这里可以添加修复逻辑或直接标记
-                    variant["sql"] = f"不完整SQL语句: {sql}"
-                fixed_variants.append(variant)
+                    variant["sql"] = INCOMPLETE_SQL_PREFIX + sql
             
-            item["variants"] = fixed_variants
             validated_list.append(item)
         else:
             validated_list.append(item)
@@ -794,54 +843,80 @@ def validate_sql_completeness(sql_list):
     return validated_list
 
 def fix_malformed_json_array(json_str):
-    """修复格式不正确的JSON数组字符串"""
-    # 如果是字符串内的JSON数组，尝试提取并解析
-    try:
-        # 尝试直接解析
-        return json.loads(json_str)
-    except json.JSONDecodeError:
-        # 如果解析失败，尝试修复常见问题
-        
-        # 检查是否是引号内的JSON字符串（如示例中的情况）
-        if json_str.startswith('"[') and json_str.endswith(']"'):
-            # 移除外层引号并转义内部引号
-            inner_json = json_str[1:-1].replace('\\"', '"')
-            try:
-                return json.loads(inner_json)
-            except json.JSONDecodeError:
-                pass
-        
-        # 检查是否有多余的转义字符
-        cleaned = json_str.replace('\\n', '\n').replace('\\"', '"')
-        if cleaned != json_str:
-            try:
-                return json.loads(cleaned)
-            except json.JSONDecodeError:
-                pass
-        
-        # 更彻底的修复尝试 - 提取所有可能的SQL语句
-        return extract_sql_statements(json_str)
+    """修复格式不正确的JSON数组字符串，总是返回列表"""
+    # 依次尝试解析：原始字符串、去掉外层引号的JSON字符串（如示例中的情况）、去除多余转义字符后的字符串
+    candidates = [json_str]
+    if json_str.startswith('"[') and json_str.endswith(']"'):
+        # 移除外层引号并转义内部引号
+        candidates.append(json_str[1:-1].replace('\\"', '"'))
+    candidates.append(json_str.replace('\\n', '\n').replace('\\"', '"'))
+    
+    # 与已尝试过的内容相同、或首字符不可能构成JSON值的候选直接跳过，
+    # 避免对LLM返回的说明文字反复抛出并捕获JSONDecodeError
+    tried = set()
+    for candidate in candidates:
+        if candidate in tried or candidate.lstrip()[:1] not in JSON_VALUE_START_CHARS:
+            continue
+        tried.add(candidate)
+        try:
+            parsed = json_loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        # 解析出的不是数组时（如单条SQL字符串或单个变体对象），作为唯一元素包装为列表
+        return parsed if isinstance(parsed, list) else [parsed]
+    
+    # 更彻底的修复尝试 - 提取所有可能的SQL语句
+    return extract_sql_statements(json_str)
 
 def extract_sql_statements(text):
-    """从文本中提取SQL语句"""
+    """从文本中提取SQL语句
+
+    说明文字中出现SQL关键字（如updated_at）时，其后的param_dependent对象仍被完整解析：
+
+    >>> extract_sql_statements('根据updated_at字段判断\\n{"type": "param_dependent", "variants": [{"sql": "SELECT * FROM t WHERE id = 1;"}, {"sql": "SELECT * FROM t WHERE id = 2;"}]}')
+    [{'type': 'param_dependent', 'variants': [{'sql': 'SELECT * FROM t WHERE id = 1;'}, {'sql': 'SELECT * FROM t WHERE id = 2;'}]}]
+    """
     # 这个函数尝试从文本中提取SQL语句，适用于LLM返回了带有说明的文本而不是纯JSON
     
-    # 尝试提取param_dependent格式的SQL
-    param_dependent_matches = re.findall(r'{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*}', text, re.DOTALL)
-    
-    # 一般性SQL语句提取
-    # 查找以SELECT、INSERT、UPDATE、DELETE等开头，以分号结尾的语句
-    sql_matches = re.findall(r'(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[\s\S]*?;', text, re.IGNORECASE)
+    # 从左到右只扫描一遍，同时提取param_dependent格式的SQL和一般性SQL语句
+    # param_dependent对象整体作为一个匹配被跳过，其内部变体的SQL不会被重复提取
+    param_dependent_matches = []
+    sql_matches = []
+    pos = 0
+    while True:
+        match = SQL_TOKEN_PATTERN.search(text, pos)
+        if not match:
+            break
+        if match.lastgroup == 'param_dependent':
+            param_dependent_matches.append(match.group())
+            pos = match.end()
+            continue
+        # 说明文字中的关键字（如updated_at、UPDATE操作）会让SQL匹配一直延伸到对象内部的第一个分号，
+        # 此时丢弃这段匹配，从对象开头重新扫描，使对象能作为param_dependent被完整匹配
+        opener = PARAM_DEPENDENT_START_PATTERN.search(text, match.start(), match.end())
+        if opener:
+            pos = opener.start()
+            continue
+        sql_matches.append(match.group())
+        pos = match.end()
     
     # 合并结果
     result = []
     
+    # 已添加变体SQL的规范化形式，只在解析param_dependent时构建一次
+    variant_sqls = set()
+    
     # 添加param_dependent类型
     for match in param_dependent_matches:
         try:
             # 尝试将提取的内容解析为JSON
-            parsed = json.loads(match)
+            parsed = json_loads(match)
             result.append(parsed)
+            variant_sqls.update(
+                normalize_sql(variant['sql'])
+                for variant in parsed.get('variants', [])
+                if isinstance(variant, dict) and isinstance(variant.get('sql'), str)
+            )
         except json.JSONDecodeError:
             # 如果解析失败，将其作为字符串添加
             result.append(match)
@@ -849,25 +924,28 @@ def extract_sql_statements(text):
     # 添加常规SQL语句
     for match in sql_matches:
         # 检查是否已经作为param_dependent的一部分添加
-        already_added = False
-        for item in result:
-            if isinstance(item, dict) and 'variants' in item:
-                for variant in item['variants']:
-                    if match in variant.get('sql', ''):
-                        already_added = True
-                        break
-        
-        if not already_added:
-            result.append(match)
+        # 对每条语句做一次集合查找，代替逐个遍历所有变体的子串查找
+        if normalize_sql(match) not in variant_sqls:
+            # LLM经常重复输出相同的SQL，驻留后相同语句共享同一个字符串对象，
+            # 后续比较可以直接命中身份相等的快速路径
+            result.append(sys.intern(match))
     
     # 如果没有找到任何SQL语句，将原始文本分割为语句
     if not result:
         statements = [stmt.strip() for stmt in text.split(';') if stmt.strip()]
-        statements = [f"{stmt};" for stmt in statements if not stmt.startswith('{') and not stmt.startswith('[')]
+        statements = [sys.intern(f"{stmt};") for stmt in statements if not stmt.startswith('{') and not stmt.startswith('[')]
         result.extend(statements)
     
     return result
 
+@lru_cache(maxsize=65536)
+def normalize_sql(sql):
+    """将SQL语句规范化为用于比较的形式：合并空白、去除末尾分号并转为小写"""
+    # 同一条SQL会在去重时与多条SQL反复比较，缓存规范化结果避免重复计算
+    # split()/join()在C层完成空白合并与首尾去除，与re.sub(r'\s+', ' ', sql).strip()结果一致
+    # 规范化结果同样驻留，不同原文规范化后相同的SQL共享同一个字符串对象
+    return sys.intern(' '.join(sql.split()).rstrip(';').lower())
+
 # 添加函数用于比较两个SQL语句是否重复
 def compare_sql_statements(sql1, sql2):
     """比较两个SQL语句是否实质上相同"""
@@ -875,53 +953,50 @@ def compare_sql_statements(sql1, sql2):
     if sql1 == sql2:
         return True
     
-    # 如果一个是字符串，一个是字典，它们不相同
-    if (isinstance(sql1, str) and isinstance(sql2, dict)) or \
-       (isinstance(sql1, dict) and isinstance(sql2, str)):
+    # 每个参数只做一次类型判断
+    if isinstance(sql1, str):
+        # 如果一个是字符串，另一个不是，它们不相同
+        if not isinstance(sql2, str):
+            return False
+        # 如果都是字符串，移除空格、换行和分号进行简化比较
+        return normalize_sql(sql1) == normalize_sql(sql2)
+    
+    # 只有都是字典（变体SQL）时才需要继续比较
+    if not (isinstance(sql1, dict) and isinstance(sql2, dict)):
         return False
     
-    # 如果都是字符串，进行简化比较
-    if isinstance(sql1, str) and isinstance(sql2, str):
-        # 移除空格、换行和分号进行比较
-        simplified1 = re.sub(r'\s+', ' ', sql1).strip().rstrip(';').lower()
-        simplified2 = re.sub(r'\s+', ' ', sql2).strip().rstrip(';').lower()
-        return simplified1 == simplified2
-    
-    # 如果都是字典（变体SQL）
-    if isinstance(sql1, dict) and isinstance(sql2, dict):
-        # 如果类型不同
-        if sql1.get('type') != sql2.get('type'):
-            return False
-        
-        # 比较变体数量
-        variants1 = sql1.get('variants', [])
-        variants2 = sql2.get('variants', [])
-        
-        if len(variants1) != len(variants2):
-            return False
-        
-        # 简单检查：检查是否有相同数量的变体具有相同的SQL
-        sql_set1 = set()
-        for variant in variants1:
-            if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
-                sql_set1.add(simplified)
-        
-        sql_set2 = set()
-        for variant in variants2:
-            if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
-                sql_set2.add(simplified)
-        
-        # 如果两个集合有重叠，认为它们可能是相同的SQL
-        return len(sql_set1.intersection(sql_set2)) > 0
+    # 如果类型不同
+    if sql1.get('type') != sql2.get('type'):
+        return False
+    
+    # 比较变体数量
+    variants1 = sql1.get('variants', [])
+    variants2 = sql2.get('variants', [])
+    
+    if len(variants1) != len(variants2):
+        return False
     
-    return False
+    # 简单检查：检查是否有相同数量的变体具有相同的SQL
+    sql_set1 = {normalize_sql(variant['sql']) for variant in variants1 if 'sql' in variant}
+    sql_set2 = {normalize_sql(variant['sql']) for variant in variants2 if 'sql' in variant}
+    
+    # 如果两个集合有重叠，认为它们可能是相同的SQL
+    # isdisjoint在找到第一个公共元素时即返回，无需构造完整交集
+    return not sql_set1.isdisjoint(sql_set2)
 
 if __name__ == '__main__':
     # 导入必要的库
     import argparse
     
+    # 设置日志
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    
     # 配置文件路径
     input_file = '/data/local_disk0/shawn/api_benchmark/cos/5-22-cos.json'
     output_file = '/data/local_disk0/shawn/api_benchmark/cos/cos_results_multi_callers_529_1316.json'
@@ -932,13 +1007,15 @@ if __name__ == '__main__':
     parser.add_argument('--input', type=str, default=input_file, help='输入JSON文件路径')
     parser.add_argument('--output', type=str, default=output_file, help='输出JSON文件路径')
     parser.add_argument('--concurrency', type=int, default=80, help='并发请求数量')
+    parser.add_argument('--jsonl', action='store_true', help='以JSON Lines格式输出，每行一个函数的结果')
     args = parser.parse_args()
     
     # 处理JSON文件
     valid_count, invalid_count = process_json_file(
         args.input, 
         args.output, 
-        args.concurrency
+        args.concurrency,
+        args.jsonl
     )
     
     print(f"统计结果: 有效ORM {valid_count}个, 无效ORM {invalid_count}个")
@@ -1,7 +1,10 @@
 import json
+import hashlib
 import os
 import asyncio
 import openai
+import httpx
+import random
 import argparse
 import re
 from tqdm import tqdm
@@ -9,6 +12,36 @@ import time
 import base64
 from mimetypes import guess_type
 
+# 优先使用orjson读写JSON，未安装时回退到标准库json
+# orjson.JSONDecodeError是json.JSONDecodeError的子类，原有的异常处理无需修改
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads
+
+# 安装了uvloop时用其基于libuv的事件循环运行主流程，降低大量协程并发时的调度开销
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# 模块中用到的正则表达式统一在此预编译，各函数直接复用
+# LLM响应中```json代码块的内容
+JSON_CODE_BLOCK_PATTERN = re.compile(r'```json\s*([\s\S]*?)```')
+# 文本中param_dependent格式的SQL变体对象
+PARAM_DEPENDENT_PATTERN = re.compile(r'{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*}', re.DOTALL)
+# 以SELECT、INSERT等关键字开头、以分号结尾的SQL语句
+# 使用[^;]*代替非贪婪的[\s\S]*?，匹配范围相同，但无需在每个字符处尝试匹配结尾
+SQL_STATEMENT_PATTERN = re.compile(r'(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[^;]*;', re.IGNORECASE)
+# SQL语句开头的语句类型关键字（允许前导空白，不区分大小写）
+SQL_TYPE_PATTERN = re.compile(r'\s*(select|insert|update|delete)', re.IGNORECASE)
+# 连续空白字符
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# SQL中的省略号或[其他字段]类型的占位符，一次扫描代替三次子串查找
+PLACEHOLDER_PATTERN = re.compile(r'\.\.\.|\[其他|其他\]')
+
 CODE_ORM_MYSQL_SQL_EXTRACT = \
     "这是一段基于goframe框架的ORM代码。goframe是Go语言的全栈开发框架，其ORM层支持链式操作、关联查询、事务处理、模型定义等多种功能。" \
     "请仔细分析代码中的表结构、字段映射、查询条件和操作类型，并完成以下任务：\n" \
@@ -118,27 +151,207 @@ CODE_ORM_MYSQL_SQL_FORMAT = \
     "6. 如果发现原始分析中的SQL语句有错误或不完整（如含有省略号、[其他字段]等占位符），请修正并补全完整的字段列表和参数。\n\n" \
     "需要格式化的内容：{sql_statement}"
 
+def split_prompt_template(template, marker):
+    """在marker处将提示词模板拆分为固定前缀与动态部分的模板
+
+    固定前缀不含占位符，在此预先完成{{ }}转义的还原，构建提示词时只需格式化较短的动态部分
+    """
+    index = template.index(marker)
+    return template[:index].format(), template[index:]
+
+EXTRACT_PROMPT_PREFIX, EXTRACT_PROMPT_SUFFIX = split_prompt_template(CODE_ORM_MYSQL_SQL_EXTRACT, "根据代码分析，该函数应该生成")
+VERIFY_PROMPT_PREFIX, VERIFY_PROMPT_SUFFIX = split_prompt_template(CODE_ORM_MYSQL_SQL_VERIFY, "6. 根据ORM代码分析，该函数应该生成")
+FORMAT_PROMPT_PREFIX, FORMAT_PROMPT_SUFFIX = split_prompt_template(CODE_ORM_MYSQL_SQL_FORMAT, "需要格式化的内容：")
+
+
+
+def load_json_file(path):
+    """读取并解析JSON文件"""
+    # 以二进制方式一次性读入，交给解析器直接处理UTF-8字节，省去文本层的逐块解码
+    with open(path, 'rb') as file:
+        return json_loads(file.read())
+
+def dump_json_file(data, path):
+    """将数据以缩进2格、保留非ASCII字符的格式写入JSON文件"""
+    if orjson:
+        # orjson在C中完成序列化，一次写出全部字节
+        with open(path, 'wb') as file:
+            file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+
+def parse_sql_json_list(text):
+    """将LLM返回的文本（可带```json代码块标记）解析为SQL语句数组，不是JSON数组时返回None"""
+    if not isinstance(text, str):
+        return None
+    text = text.strip()
+    match = JSON_CODE_BLOCK_PATTERN.search(text)
+    if match:
+        text = match.group(1).strip()
+    if not (text.startswith('[') and text.endswith(']')):
+        return None
+    try:
+        sql_list = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return sql_list if isinstance(sql_list, list) else None
+
+def build_code_chain(code_meta_data, field):
+    """将code_meta_data中各段代码拼接为一个字符串，每段代码后接换行
+
+    字符串元素直接使用，字典元素取field字段（生成阶段为code_value，验证阶段为code），缺少该字段的元素跳过
+    """
+    return ''.join(
+        f"{meta}\n" if isinstance(meta, str) else f"{meta[field]}\n"
+        for meta in code_meta_data
+        if isinstance(meta, str) or (isinstance(meta, dict) and field in meta)
+    )
 
+async def process_function_async(function_info, semaphore):
+    """依次完成单个函数的SQL生成、验证与格式化，结果写回function_info并将其返回"""
+    function_name = function_info['function_name']
+    
+    # 提取所需信息
+    function_definition = function_info.get('function_definition', '')
+    
+    # 获取callers的第一个元素（如果存在）
+    caller = ""
+    if function_info.get('callers') and len(function_info['callers']) > 0:
+        caller = function_info['callers'][0]['code_value']
+    
+    # 拼接code_meta_data的所有元素，生成与验证两个阶段各自所需的上下文只构建一次
+    code_meta_data = function_info.get('code_meta_data', [])
+    code_meta_data_str = build_code_chain(code_meta_data, 'code_value')
+    code_chain = build_code_chain(code_meta_data, 'code')
+    # 获取sql_pattern_cnt（如果存在）
+    sql_pattern_cnt = function_info.get('sql_pattern_cnt', None)
+    
+    # 构建提示词，使用CODE_ORM_MYSQL_SQL_EXTRACT模板
+    prompt = EXTRACT_PROMPT_PREFIX + EXTRACT_PROMPT_SUFFIX.format(
+        function_name=function_name,
+        function_definition=function_definition,
+        caller=caller,
+        code_meta_data_str=code_meta_data_str,
+        sql_pattern_cnt=sql_pattern_cnt if sql_pattern_cnt is not None else ""
+    )
+    
+    # 生成SQL语句
+    try:
+        sql_statement = await send_request_async(prompt, semaphore)
+    except Exception as e:
+        print(f"SQL生成任务 {function_name} 失败: {e}")
+        # 跳过验证与格式化，由调用方按请求失败处理
+        function_info['sql_statement'] = f"请求失败: {function_name}"
+        return function_info
+    function_info['sql_statement'] = sql_statement
+    print(f"SQL生成任务 {function_name} 完成，开始验证")
+    
+    # 验证SQL语句
+    try:
+        verified_sql = await verify_sql_async(
+            sql_statement, 
+            function_definition=function_definition,
+            code_chain=code_chain,
+            caller=caller,
+            semaphore=semaphore,
+            sql_pattern_cnt=sql_pattern_cnt
+        )
+        print(f"验证任务 {function_name} 完成，开始格式化")
+    except Exception as e:
+        print(f"验证任务 {function_name} 失败: {e}")
+        verified_sql = sql_statement  # 使用原始SQL
+    function_info['verified_sql'] = verified_sql
+    
+    # 验证结果已是JSON数组时直接使用，省去格式化请求
+    sql_list = parse_sql_json_list(verified_sql)
+    if sql_list is not None:
+        print(f"验证结果 {function_name} 已是JSON数组，跳过格式化")
+    else:
+        # 格式化SQL语句
+        try:
+            sql_list = await format_sql_async(verified_sql, semaphore)
+            print(f"格式化任务 {function_name} 完成")
+        except Exception as e:
+            print(f"格式化任务 {function_name} 失败: {e}")
+            sql_list = extract_sql_statements(verified_sql)
+    
+    # 如果sql_list仍然是格式不正确的字符串，尝试修复
+    if isinstance(sql_list, str):
+        sql_list = fix_malformed_json_array(sql_list)
+    
+    # 验证SQL语句完整性
+    sql_list = validate_sql_completeness(sql_list)
+    
+    # 将SQL语句列表添加到函数信息中
+    function_info['sql_statement_list'] = sql_list
+    
+    # 添加SQL类型分类
+    sql_types = []
+    for sql in sql_list:
+        sql_types.append(classify_sql(sql))
+    function_info['sql_types'] = sql_types
+    return function_info
+
+def load_checkpoint(checkpoint_file):
+    """读取检查点文件中已完成的函数结果，返回以function_name为键的字典"""
+    finished = {}
+    if not os.path.exists(checkpoint_file):
+        return finished
+    with open(checkpoint_file, 'rb') as file:
+        for line in file:
+            try:
+                record = json_loads(line)
+            except json.JSONDecodeError:
+                # 中断时可能留下写了一半的行，跳过即可，该函数会重新处理
+                continue
+            finished[record['function_name']] = record
+    return finished
 
-async def process_json_file_async(input_file, output_file, concurrency=80):
-    """处理JSON文件并将结果保存到单个文件中，包含SQL语句"""
-    # 验证输入文件
-    if not validate_input_file(input_file):
+def append_checkpoint_record(file, record):
+    """以JSON Lines格式向检查点文件追加一条函数结果并立即刷新到磁盘"""
+    if orjson:
+        file.write(orjson.dumps(record) + b'\n')
+    else:
+        file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+    file.flush()
+
+async def process_json_file_async(input_file, output_file, concurrency=80,
+                                  max_requests_per_min=None, max_tokens_per_min=None, cache_file=None):
+    """处理JSON文件并将结果保存到单个文件中，包含SQL语句
+
+    max_requests_per_min/max_tokens_per_min用于限制每分钟发出的请求数与token数
+    cache_file不为空时从该文件加载LLM响应缓存，处理结束后写回
+    """
+    global LLM_RATE_LIMITER
+    # 读取输入文件，必要字段的检查在下方整理函数信息时一并完成
+    try:
+        data = load_json_file(input_file)
+    except (OSError, ValueError) as e:
+        print(f"输入文件验证失败: {e}")
+        print("输入文件验证失败，终止处理")
+        return 0, 0
+    if not isinstance(data, (dict, list)):
+        print(f"警告: 输入文件格式不是字典或列表类型，而是 {type(data)}")
         print("输入文件验证失败，终止处理")
         return 0, 0
     
-    # 读取输入文件
-    with open(input_file, 'r', encoding='utf-8') as file:
-        data = json.load(file)
+    # 加载LLM响应缓存
+    load_llm_cache(cache_file)
     
     # 创建信号量控制并发请求数
     semaphore = asyncio.Semaphore(concurrency)
+    # 按需创建速率限制器，使请求速度与服务端的处理能力匹配
+    if max_requests_per_min or max_tokens_per_min:
+        LLM_RATE_LIMITER = RateLimiter(max_requests_per_min, max_tokens_per_min)
     
     # 准备所有函数信息
     all_functions = []
     if isinstance(data, dict):
         # 如果是字典类型，按原来的方式处理
         for function_name_or_path, function_info in data.items():
+            if 'function_definition' not in function_info:
+                print(f"警告: {function_name_or_path} 缺少 function_definition 字段")
             # 确保function_info包含function_name
             function_info['function_name'] = function_name_or_path
             # 默认所有函数都是有效的，跳过验证阶段
@@ -151,6 +364,8 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
             if not isinstance(function_info, dict):
                 print(f"警告: 索引 {i} 处的元素不是字典类型，跳过")
                 continue
+            if 'function_definition' not in function_info:
+                print(f"警告: 索引 {i} 处的元素缺少 function_definition 字段")
             # 如果没有function_name字段，使用索引作为函数名
             if 'function_name' not in function_info:
                 function_info['function_name'] = f"function_{i}"
@@ -162,228 +377,45 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
     invalid_count = 0
 
 
-    # 为所有ORM代码生成SQL语句
-    print("开始为所有ORM代码生成SQL语句")
-    initial_tasks = []
-    function_info_map = {}
-    
-    for function_info in all_functions:
-        function_name = function_info['function_name']
-        print(f"添加SQL生成任务: {function_name}")
-        
-        # 提取所需信息
-        function_definition = function_info.get('function_definition', '')
-        
-        # 获取callers的第一个元素（如果存在）
-        caller = ""
-        if function_info.get('callers') and len(function_info['callers']) > 0:
-            caller = function_info['callers'][0]['code_value']
-        
-        # 获取code_meta_data的所有元素
-        code_meta_data = function_info.get('code_meta_data', [])
-        code_meta_data_str = ""
-        for meta in code_meta_data:
-            code_meta_data_str += meta['code_value'] + "\n"
-        # 获取sql_pattern_cnt（如果存在）
-        sql_pattern_cnt = function_info.get('sql_pattern_cnt', None)
-        
-        # 构建提示词，使用CODE_ORM_MYSQL_SQL_EXTRACT模板
-        prompt = CODE_ORM_MYSQL_SQL_EXTRACT.format(
-            function_name=function_name,
-            function_definition=function_definition,
-            caller=caller,
-            code_meta_data_str=code_meta_data_str,
-            sql_pattern_cnt=sql_pattern_cnt if sql_pattern_cnt is not None else ""
-        )
-        
-        # 创建异步任务
-        task = asyncio.create_task(send_request_async(prompt, semaphore))
-        initial_tasks.append(task)
-        
-        # 保存函数信息以便后续处理
-        function_info_map[task] = function_info
-    
-    # 并发等待所有初始任务完成
-    if initial_tasks:
-        print(f"等待所有 {len(initial_tasks)} 个SQL生成任务完成...")
-        initial_results = await asyncio.gather(*initial_tasks, return_exceptions=True)
-    else:
-        initial_results = []
-    
-    # 保存第二阶段检查点
-    for i, sql_statement in enumerate(initial_results):
-        if i >= len(initial_tasks):
-            continue
-            
-        task = initial_tasks[i]
-        function_info = function_info_map[task]
-        
-        # 检查是否有异常
-        if isinstance(sql_statement, Exception):
-            function_info['sql_statement'] = f"请求失败: {str(sql_statement)}"
-        else:
-            function_info['sql_statement'] = sql_statement
-    
-    result_dict_phase2 = {}
-    for function_info in all_functions:
-        function_name = function_info['function_name']
-        result_dict_phase2[function_name] = function_info
-    
-    
-    # 验证SQL语句
-    print("开始验证SQL语句")
-    verify_tasks = []
-    verify_map = {}
-    
-    for i, sql_statement in enumerate(initial_results):
-        if i >= len(initial_tasks):
-            continue
-            
-        task = initial_tasks[i]
-        function_info = function_info_map[task]
-        function_name = function_info['function_name']
-        
-        # 检查是否有异常
-        if isinstance(sql_statement, Exception):
-            print(f"SQL生成任务 {function_name} 失败: {sql_statement}")
-            sql_statement = f"请求失败: {function_name}"
-            # 跳过验证
-            function_info['sql_statement'] = sql_statement
-            continue
-        else:
-            print(f"SQL生成任务 {function_name} 完成，开始验证")
-        
-        # 获取sql_pattern_cnt（如果存在）
-        sql_pattern_cnt = function_info.get('sql_pattern_cnt', None)
-        
-        # 构建提示词，使用CODE_ORM_MYSQL_SQL_VERIFY模板
-        code_chain = ""
-        if function_info.get('code_meta_data') and len(function_info['code_meta_data']) > 0:
-            for meta in function_info['code_meta_data']:
-                if isinstance(meta, str):
-                    code_chain += f"{meta}\n"
-                elif isinstance(meta, dict) and 'code' in meta:
-                    code_chain += f"{meta.get('code', '')}\n"
-        
-        
-        # 创建验证任务
-        verify_task = asyncio.create_task(
-            verify_sql_async(
-                sql_statement, 
-                function_definition=function_info.get('function_definition', ''),
-                code_meta_data=function_info.get('code_meta_data', []),
-                caller=caller,
-                semaphore=semaphore,
-                sql_pattern_cnt=sql_pattern_cnt
-            )
-        )
-        verify_tasks.append(verify_task)
-        verify_map[verify_task] = {
-            'function_info': function_info,
-            'original_sql': sql_statement
-        }
-    
-    # 并发等待所有验证任务完成
-    if verify_tasks:
-        print(f"等待所有 {len(verify_tasks)} 个验证任务完成...")
-        verify_results = await asyncio.gather(*verify_tasks, return_exceptions=True)
-    else:
-        verify_results = []
-    
-    # 保存第三阶段检查点
-    for i, verified_sql in enumerate(verify_results):
-        if i >= len(verify_tasks):
-            continue
-            
-        task = verify_tasks[i]
-        task_info = verify_map[task]
-        function_info = task_info['function_info']
-        
-        # 检查是否有异常
-        if isinstance(verified_sql, Exception):
-            function_info['verified_sql'] = task_info['original_sql']
-        else:
-            function_info['verified_sql'] = verified_sql
-    
-    result_dict_phase3 = {}
+    # 每个函数完成后立即追加到检查点文件，中断后重新运行时跳过已完成的函数
+    checkpoint_file = f"{output_file}.partial.jsonl"
+    finished = load_checkpoint(checkpoint_file)
+    pending_functions = []
     for function_info in all_functions:
-        function_name = function_info['function_name']
-        result_dict_phase3[function_name] = function_info
-    
-    
-    # 格式化SQL语句
-    print("开始格式化SQL语句")
-    format_tasks = []
-    format_map = {}
-    
-    for i, verified_sql in enumerate(verify_results):
-        if i >= len(verify_tasks):
-            continue
-            
-        task = verify_tasks[i]
-        task_info = verify_map[task]
-        function_info = task_info['function_info']
-        function_name = function_info['function_name']
-        
-        # 检查是否有异常
-        if isinstance(verified_sql, Exception):
-            print(f"验证任务 {function_name} 失败: {verified_sql}")
-            verified_sql = task_info['original_sql']  # 使用原始SQL
+        record = finished.get(function_info['function_name'])
+        if record is not None:
+            function_info.update(record)
         else:
-            print(f"验证任务 {function_name} 完成，开始格式化")
-        
-        # 创建格式化任务
-        format_task = asyncio.create_task(format_sql_async(verified_sql, semaphore))
-        format_tasks.append(format_task)
-        format_map[format_task] = {
-            'function_info': function_info,
-            'verified_sql': verified_sql
-        }
-    
-    # 并发等待所有格式化任务完成
-    if format_tasks:
-        print(f"等待所有 {len(format_tasks)} 个格式化任务完成...")
-        format_results = await asyncio.gather(*format_tasks, return_exceptions=True)
-    else:
-        format_results = []
-    
+            pending_functions.append(function_info)
+    if finished:
+        print(f"从检查点恢复 {len(all_functions) - len(pending_functions)} 个已完成的函数")
 
-    for i, sql_list in enumerate(format_results):
-        if i >= len(format_tasks):
-            continue
-            
-        task = format_tasks[i]
-        task_info = format_map[task]
-        function_info = task_info['function_info']
-        function_name = function_info['function_name']
-        
-        # 检查是否有异常
-        if isinstance(sql_list, Exception):
-            print(f"格式化任务 {function_name} 失败: {sql_list}")
-            verified_sql = task_info['verified_sql']
-            sql_list = extract_sql_statements(verified_sql)
-        else:
-            print(f"格式化任务 {function_name} 完成")
-        
-        # 如果sql_list仍然是格式不正确的字符串，尝试修复
-        if isinstance(sql_list, str):
-            sql_list = fix_malformed_json_array(sql_list)
-        
-        # 验证SQL语句完整性
-        sql_list = validate_sql_completeness(sql_list)
-        
-        # 将SQL语句列表添加到函数信息中
-        function_info['sql_statement_list'] = sql_list
-        
-        # 添加SQL类型分类
-        sql_types = []
-        for sql in sql_list:
-            sql_types.append(classify_sql(sql))
-        function_info['sql_types'] = sql_types
-        
+    # 为所有ORM代码生成SQL语句，每个函数依次完成生成、验证、格式化三个阶段，
+    # 各函数之间并发执行，不必等待所有函数完成上一阶段
+    print("开始为所有ORM代码生成SQL语句")
+    function_tasks = []
+    for function_info in pending_functions:
+        print(f"添加SQL生成任务: {function_info['function_name']}")
+        function_tasks.append(process_function_async(function_info, semaphore))
+    
+    # 按完成顺序处理结果，完成一个写入一个
+    if function_tasks:
+        print(f"等待所有 {len(function_tasks)} 个函数的处理任务完成...")
+        with open(checkpoint_file, 'ab') as checkpoint:
+            for future in asyncio.as_completed(function_tasks):
+                try:
+                    function_info = await future
+                except Exception as e:
+                    print(f"处理函数失败: {e}")
+                    continue
+                # 只记录完整走完流程的函数。SQL生成请求失败的函数在process_function_async中
+                # 不会得到sql_statement_list，不写入检查点，下次运行时重试
+                if 'sql_statement_list' in function_info:
+                    append_checkpoint_record(checkpoint, function_info)
+    
 
     # 处理未进入格式化阶段的函数
-    for task, function_info in function_info_map.items():
+    for function_info in all_functions:
         if 'sql_statement' in function_info and 'sql_statement_list' not in function_info:
             # 这些是由于初始请求失败而跳过验证的函数
             function_info['sql_statement_list'] = [function_info['sql_statement']]
@@ -419,19 +451,18 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
         function_name = function_info['function_name']
         result_dict[function_name] = function_info
     
-    # 检查输入文件格式，决定输出格式
-    with open(input_file, 'r', encoding='utf-8') as file:
-        input_data = json.load(file)
-    
-    # 如果输入是列表格式，输出也用列表格式
-    if isinstance(input_data, list):
+    # 如果输入是列表格式，输出也用列表格式（按开头已解析的数据判断，无需重新读取输入文件）
+    if isinstance(data, list):
         output_data = list(result_dict.values())
     else:
         # 如果输入是字典格式，输出也用字典格式
         output_data = result_dict
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    dump_json_file(output_data, output_file)
+    
+    # 结果已完整写出，不再需要检查点
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
     
     print(f"处理完成，已将结果保存到 {output_file}")
     
@@ -443,43 +474,21 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
                 sql_type_counts[sql_type] += 1
     
     print(f"SQL类型统计: {sql_type_counts}")
+    print(f"LLM响应缓存: 命中 {LLM_CACHE_STATS['hits']} 次, 未命中 {LLM_CACHE_STATS['misses']} 次")
+    
+    # 保存LLM响应缓存
+    save_llm_cache(cache_file)
     
     return valid_count, invalid_count
 
 
 
-def process_json_file(input_file, output_file, concurrency=80):
+def process_json_file(input_file, output_file, concurrency=80,
+                      max_requests_per_min=None, max_tokens_per_min=None, cache_file=None):
     """同步版本的处理函数"""
-    return asyncio.run(process_json_file_async(input_file, output_file, concurrency))
-
-# 添加输入验证
-def validate_input_file(input_file):
-    try:
-        with open(input_file, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        # 验证必要字段
-        if isinstance(data, dict):
-            # 如果是字典类型，按原来的方式处理
-            for function_name, function_info in data.items():
-                if 'function_definition' not in function_info:
-                    print(f"警告: {function_name} 缺少 function_definition 字段")
-        elif isinstance(data, list):
-            # 如果是列表类型，检查每个元素是否包含必要字段
-            for i, function_info in enumerate(data):
-                if not isinstance(function_info, dict):
-                    print(f"警告: 索引 {i} 处的元素不是字典类型")
-                    continue
-                if 'function_definition' not in function_info:
-                    print(f"警告: 索引 {i} 处的元素缺少 function_definition 字段")
-        else:
-            print(f"警告: 输入文件格式不是字典或列表类型，而是 {type(data)}")
-            return False
-            
-        return True
-    except Exception as e:
-        print(f"输入文件验证失败: {e}")
-        return False
+    run = uvloop.run if uvloop else asyncio.run
+    return run(process_json_file_async(input_file, output_file, concurrency,
+                                               max_requests_per_min, max_tokens_per_min, cache_file))
 
 # 添加SQL分类功能
 def classify_sql(sql_statement):
@@ -490,86 +499,216 @@ def classify_sql(sql_statement):
             return "PARAM_DEPENDENT"
         # 尝试从字典中获取第一个SQL语句进行分类
         if "sql" in sql_statement and isinstance(sql_statement["sql"], str):
-            sql_lower = sql_statement["sql"].lower().strip()
+            sql = sql_statement["sql"]
         elif "variants" in sql_statement and len(sql_statement["variants"]) > 0:
             # 使用第一个变体的SQL进行分类
             first_variant = sql_statement["variants"][0]
             if "sql" in first_variant and isinstance(first_variant["sql"], str):
-                sql_lower = first_variant["sql"].lower().strip()
+                sql = first_variant["sql"]
             else:
                 return "OTHER"
         else:
             return "OTHER"
     elif isinstance(sql_statement, str):
-        # 原始的字符串处理逻辑
-        sql_lower = sql_statement.lower().strip()
+        sql = sql_statement
     else:
         # 处理其他类型
         return "OTHER"
     
-    # 分类逻辑
-    if sql_lower.startswith("select"):
-        return "SELECT"
-    elif sql_lower.startswith("insert"):
-        return "INSERT"
-    elif sql_lower.startswith("update"):
-        return "UPDATE"
-    elif sql_lower.startswith("delete"):
-        return "DELETE"
-    else:
-        return "OTHER"
+    # 分类逻辑：直接在原字符串上匹配开头的关键字，无需生成小写副本
+    match = SQL_TYPE_PATTERN.match(sql)
+    return match.group(1).upper() if match else "OTHER"
+
+# LLM请求参数
+LLM_MODEL = "default"
+LLM_TEMPERATURE = 0.7
+# 单次请求生成token数的上限
+LLM_MAX_TOKENS = 8096
+
+# 连接池大小，需不小于并发请求数，否则超出部分的请求要排队等待连接或反复新建连接
+LLM_MAX_CONNECTIONS = 256
+
+# 所有请求共用一个客户端，复用其连接池中的长连接
+LLM_CLIENT = openai.AsyncClient(
+    base_url="http://0.0.0.0:8081/v1",
+    api_key="EMPTY",
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        timeout=httpx.Timeout(600.0, connect=10.0)
+    )
+)
+
+class RateLimiter:
+    """按分钟限制请求数与token数的令牌桶，额度随时间连续补充，上限为每分钟的配额"""
+
+    def __init__(self, max_requests_per_min=None, max_tokens_per_min=None):
+        self.max_requests_per_min = max_requests_per_min
+        self.max_tokens_per_min = max_tokens_per_min
+        self.requests_remaining = max_requests_per_min or 0
+        self.tokens_remaining = max_tokens_per_min or 0
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        """按距上次补充经过的时间补充额度"""
+        now = time.monotonic()
+        elapsed_min = (now - self.last_refill) / 60
+        self.last_refill = now
+        if self.max_requests_per_min:
+            self.requests_remaining = min(self.max_requests_per_min,
+                                          self.requests_remaining + elapsed_min * self.max_requests_per_min)
+        if self.max_tokens_per_min:
+            self.tokens_remaining = min(self.max_tokens_per_min,
+                                        self.tokens_remaining + elapsed_min * self.max_tokens_per_min)
+
+    async def acquire(self, est_tokens):
+        """等待直到额度足够发送一个约含est_tokens个token的请求，并扣除相应额度"""
+        if self.max_tokens_per_min:
+            est_tokens = min(est_tokens, self.max_tokens_per_min)
+        # 加锁使等待的请求按到达顺序依次获得额度
+        async with self.lock:
+            while True:
+                self.refill()
+                wait_min = 0
+                if self.max_requests_per_min and self.requests_remaining < 1:
+                    wait_min = (1 - self.requests_remaining) / self.max_requests_per_min
+                if self.max_tokens_per_min and self.tokens_remaining < est_tokens:
+                    wait_min = max(wait_min, (est_tokens - self.tokens_remaining) / self.max_tokens_per_min)
+                if wait_min <= 0:
+                    break
+                await asyncio.sleep(wait_min * 60)
+            self.requests_remaining -= 1
+            self.tokens_remaining -= est_tokens
+
+# 请求速率限制器，由process_json_file_async按参数创建，为None时不限速
+LLM_RATE_LIMITER = None
+
+# LLM响应缓存：以请求内容的SHA256摘要为键缓存响应文本，相同的请求只发送一次
+LLM_RESPONSE_CACHE = {}
+# 进行中的请求，相同请求并发到达时等待同一个请求的结果
+LLM_PENDING_REQUESTS = {}
+LLM_CACHE_STATS = {"hits": 0, "misses": 0}
+
+def llm_cache_key(system_prompt, prompt):
+    """根据模型、系统提示词、用户提示词和温度计算缓存键"""
+    payload = json.dumps(
+        {"m": LLM_MODEL, "s": system_prompt, "u": prompt, "t": LLM_TEMPERATURE},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_llm_cache(cache_file):
+    """从文件加载LLM响应缓存，文件不存在时忽略"""
+    if not cache_file or not os.path.exists(cache_file):
+        return
+    try:
+        # 忽略旧缓存文件中可能存在的空响应
+        LLM_RESPONSE_CACHE.update(
+            (key, content) for key, content in load_json_file(cache_file).items()
+            if isinstance(content, str) and content
+        )
+        print(f"已加载 {len(LLM_RESPONSE_CACHE)} 条LLM响应缓存")
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"加载LLM响应缓存失败: {e}")
+
+def save_llm_cache(cache_file):
+    """将LLM响应缓存写入文件"""
+    if not cache_file:
+        return
+    with open(cache_file, 'w', encoding='utf-8') as file:
+        json.dump(LLM_RESPONSE_CACHE, file, ensure_ascii=False)
+
+# 重试等待的基准时长与上限（秒）
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 60
+
+def is_retryable_error(error):
+    """判断请求错误是否值得重试：限流、服务端错误与连接错误可重试，其余4xx错误重试也不会成功"""
+    if isinstance(error, (openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return not isinstance(error, openai.APIStatusError)
+
+def retry_delay(retry_count, error):
+    """计算第retry_count次重试前的等待时长：指数退避加全抖动，服务端返回Retry-After时至少等待该时长"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retry_count))
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get('retry-after')))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+async def chat_completion_async(system_prompt, prompt):
+    """发送聊天请求并返回响应文本，命中缓存时不再请求"""
+    key = llm_cache_key(system_prompt, prompt)
+    while True:
+        if key in LLM_RESPONSE_CACHE:
+            LLM_CACHE_STATS['hits'] += 1
+            return LLM_RESPONSE_CACHE[key]
+        pending = LLM_PENDING_REQUESTS.get(key)
+        if pending is None:
+            break
+        # 相同请求正在进行中，等待其完成后从缓存读取；若该请求失败则由当前调用重新发送
+        await pending
+
+    LLM_CACHE_STATS['misses'] += 1
+    pending = asyncio.get_running_loop().create_future()
+    LLM_PENDING_REQUESTS[key] = pending
+    try:
+        if LLM_RATE_LIMITER:
+            # 提示词以中文为主，粗略按每2个字符1个token估算
+            await LLM_RATE_LIMITER.acquire((len(system_prompt) + len(prompt)) // 2)
+        response = await LLM_CLIENT.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=LLM_TEMPERATURE,
+            max_tokens=LLM_MAX_TOKENS,
+        )
+        content = response.choices[0].message.content
+        # 只缓存非空的文本响应。内容为空（None或空字符串）时不缓存，
+        # 调用方重试时会重新发送请求，而不是反复读到同一个空响应
+        if isinstance(content, str) and content:
+            LLM_RESPONSE_CACHE[key] = content
+        return content
+    finally:
+        del LLM_PENDING_REQUESTS[key]
+        pending.set_result(None)
 
 # 添加缺失的函数
 async def send_request_async(question, semaphore):
+    """发送SQL生成请求并返回响应文本，重试耗尽或遇到不可重试的错误时抛出最后一次的异常"""
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://0.0.0.0:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         max_retries = 3
         retry_count = 0
         
-        while retry_count < max_retries:
+        while True:
             try:
-                response = await client.chat.completions.create(
-                    model="default",
-                    messages=[
-                        {"role": "system", "content": ""},
-                        {"role": "user", "content": question},
-                    ],
-                    temperature=0.7,
-                    max_tokens=8096,
-                )
-                return response.choices[0].message.content
+                content = await chat_completion_async("", question)
+                return content
             except Exception as e:
+                if not is_retryable_error(e):
+                    print(f"请求出错且不可重试: {e}")
+                    raise
                 retry_count += 1
                 print(f"{question[:50]}... 重试 {retry_count}/{max_retries}, 错误: {e}")
-                await asyncio.sleep(1)
-        
-        # 如果所有重试都失败，返回错误信息
-        return f"请求失败: {question[:50]}..."
+                # 所有重试都失败时抛出异常，由调用方按请求失败处理，
+                # 不能返回错误信息文本，否则会被当作生成结果继续验证、格式化并写入检查点
+                if retry_count >= max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(retry_count, e))
 
-async def verify_sql_async(sql_statement, function_definition=None, code_meta_data=None, caller=None, semaphore=None, sql_pattern_cnt=None):
+async def verify_sql_async(sql_statement, function_definition=None, code_chain=None, caller=None, semaphore=None, sql_pattern_cnt=None):
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://0.0.0.0:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         # 构建提示词，使用CODE_ORM_MYSQL_SQL_VERIFY模板
-        code_chain = ""
-        if code_meta_data and len(code_meta_data) > 0:
-            for meta in code_meta_data:
-                if isinstance(meta, str):
-                    code_chain += f"{meta}\n"
-                elif isinstance(meta, dict) and 'code' in meta:
-                    code_chain += f"{meta.get('code', '')}\n"
-        
-        prompt = CODE_ORM_MYSQL_SQL_VERIFY.format(
+        prompt = VERIFY_PROMPT_PREFIX + VERIFY_PROMPT_SUFFIX.format(
             function_definition=function_definition if function_definition else "",
             caller=caller if caller else "",
-            code_chain=code_chain,
+            code_chain=code_chain if code_chain else "",
             sql_statement=sql_statement,
             sql_pattern_cnt=sql_pattern_cnt if sql_pattern_cnt is not None else ""
         )
@@ -579,20 +718,16 @@ async def verify_sql_async(sql_statement, function_definition=None, code_meta_da
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
-                    model="default",
-                    messages=[
-                        {"role": "system", "content": "你是一个SQL专家，擅长分析和修正SQL语句。"},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.7,
-                    max_tokens=8096,
-                )
-                return response.choices[0].message.content
+                content = await chat_completion_async("你是一个SQL专家，擅长分析和修正SQL语句。", prompt)
+                return content
             except Exception as e:
+                if not is_retryable_error(e):
+                    print(f"请求出错且不可重试: {e}")
+                    break
                 retry_count += 1
                 print(f"验证SQL时出错，正在重试 {retry_count}/{max_retries}: {e}")
-                await asyncio.sleep(1)
+                if retry_count < max_retries:
+                    await asyncio.sleep(retry_delay(retry_count, e))
         
         # 如果所有重试都失败，返回原始SQL
         print(f"验证SQL失败，返回原始SQL")
@@ -600,13 +735,8 @@ async def verify_sql_async(sql_statement, function_definition=None, code_meta_da
 
 async def format_sql_async(sql_statement, semaphore):
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://0.0.0.0:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         # 构建提示词，使用CODE_ORM_MYSQL_SQL_FORMAT模板
-        prompt = CODE_ORM_MYSQL_SQL_FORMAT.format(
+        prompt = FORMAT_PROMPT_PREFIX + FORMAT_PROMPT_SUFFIX.format(
             sql_statement=sql_statement
         )
         
@@ -615,23 +745,15 @@ async def format_sql_async(sql_statement, semaphore):
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
-                    model="default",
-                    messages=[
-                        {"role": "system", "content": "你是一个SQL格式化专家，擅长将SQL语句转换为标准JSON格式。"},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.7,
-                    max_tokens=8096,
-                )
+                content = await chat_completion_async("你是一个SQL格式化专家，擅长将SQL语句转换为标准JSON格式。", prompt)
                 
                 # 尝试解析响应为JSON数组
-                formatted_response = response.choices[0].message.content.strip()
+                formatted_response = content.strip()
                 try:
                     # 检查是否包含```json标记
                     if "```json" in formatted_response:
                         # 提取json部分
-                        match = re.search(r'```json\s*([\s\S]*?)```', formatted_response)
+                        match = JSON_CODE_BLOCK_PATTERN.search(formatted_response)
                         if match:
                             json_content = match.group(1).strip()
                             # 解析提取出的json内容
@@ -660,9 +782,13 @@ async def format_sql_async(sql_statement, semaphore):
                     return sql_statements
                 
             except Exception as e:
+                if not is_retryable_error(e):
+                    print(f"请求出错且不可重试: {e}")
+                    break
                 retry_count += 1
                 print(f"格式化SQL时出错，正在重试 {retry_count}/{max_retries}: {e}")
-                await asyncio.sleep(1)
+                if retry_count < max_retries:
+                    await asyncio.sleep(retry_delay(retry_count, e))
         
         # 如果所有重试都失败，尝试简单分割
         print(f"格式化SQL失败，尝试简单分割")
@@ -689,7 +815,7 @@ def validate_sql_completeness(sql_list):
     for item in sql_list:
         if isinstance(item, str):
             # 检查字符串中是否有省略号或[其他字段]类型的占位符
-            if "..." in item or "[其他" in item or "其他]" in item:
+            if PLACEHOLDER_PATTERN.search(item):
                 # 尝试修复或标记为不完整
                 print(f"发现不完整SQL语句: {item}")
                 # 这里可以添加修复逻辑或直接标记
@@ -701,7 +827,7 @@ def validate_sql_completeness(sql_list):
             fixed_variants = []
             for variant in item.get("variants", []):
                 sql = variant.get("sql", "")
-                if "..." in sql or "[其他" in sql or "其他]" in sql:
+                if PLACEHOLDER_PATTERN.search(sql):
                     print(f"发现不完整SQL变体: {sql}")
                     # 这里可以添加修复逻辑或直接标记
                     variant["sql"] = f"不完整SQL语句: {sql}"
@@ -748,11 +874,11 @@ def extract_sql_statements(text):
     # 这个函数尝试从文本中提取SQL语句，适用于LLM返回了带有说明的文本而不是纯JSON
     
     # 尝试提取param_dependent格式的SQL
-    param_dependent_matches = re.findall(r'{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*}', text, re.DOTALL)
+    param_dependent_matches = PARAM_DEPENDENT_PATTERN.findall(text)
     
     # 一般性SQL语句提取
     # 查找以SELECT、INSERT、UPDATE、DELETE等开头，以分号结尾的语句
-    sql_matches = re.findall(r'(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[\s\S]*?;', text, re.IGNORECASE)
+    sql_matches = SQL_STATEMENT_PATTERN.findall(text)
     
     # 合并结果
     result = []
@@ -804,8 +930,8 @@ def compare_sql_statements(sql1, sql2):
     # 如果都是字符串，进行简化比较
     if isinstance(sql1, str) and isinstance(sql2, str):
         # 移除空格、换行和分号进行比较
-        simplified1 = re.sub(r'\s+', ' ', sql1).strip().rstrip(';').lower()
-        simplified2 = re.sub(r'\s+', ' ', sql2).strip().rstrip(';').lower()
+        simplified1 = WHITESPACE_PATTERN.sub(' ', sql1).strip().rstrip(';').lower()
+        simplified2 = WHITESPACE_PATTERN.sub(' ', sql2).strip().rstrip(';').lower()
         return simplified1 == simplified2
     
     # 如果都是字典（变体SQL）
@@ -825,13 +951,13 @@ def compare_sql_statements(sql1, sql2):
         sql_set1 = set()
         for variant in variants1:
             if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
+                simplified = WHITESPACE_PATTERN.sub(' ', variant['sql']).strip().rstrip(';').lower()
                 sql_set1.add(simplified)
         
         sql_set2 = set()
         for variant in variants2:
             if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
+                simplified = WHITESPACE_PATTERN.sub(' ', variant['sql']).strip().rstrip(';').lower()
                 sql_set2.add(simplified)
         
         # 如果两个集合有重叠，认为它们可能是相同的SQL
@@ -853,13 +979,19 @@ if __name__ == '__main__':
     parser.add_argument('--input', type=str, default=input_file, help='输入JSON文件路径')
     parser.add_argument('--output', type=str, default=output_file, help='输出JSON文件路径')
     parser.add_argument('--concurrency', type=int, default=80, help='并发请求数量')
+    parser.add_argument('--max-requests-per-min', type=int, default=None, help='每分钟最多发出的请求数，不指定时不限制')
+    parser.add_argument('--max-tokens-per-min', type=int, default=None, help='每分钟最多发出的提示词token数（估算），不指定时不限制')
+    parser.add_argument('--cache-file', type=str, default=None, help='LLM响应缓存文件路径，不指定时只在本次运行内缓存')
     args = parser.parse_args()
     
     # 处理JSON文件
     valid_count, invalid_count = process_json_file(
         args.input, 
         args.output, 
-        args.concurrency
+        args.concurrency,
+        args.max_requests_per_min,
+        args.max_tokens_per_min,
+        args.cache_file
     )
     
     print(f"统计结果: 有效ORM {valid_count}个, 无效ORM {invalid_count}个")
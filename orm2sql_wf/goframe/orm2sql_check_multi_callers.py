@@ -9,6 +9,21 @@ import time
 import base64
 from mimetypes import guess_type
 
+# 模块中用到的正则表达式统一在此预编译，各函数直接复用
+# LLM响应中```json代码块的内容
+JSON_CODE_BLOCK_PATTERN = re.compile(r'```json\s*([\s\S]*?)```')
+# 文本中param_dependent格式的SQL变体对象
+PARAM_DEPENDENT_PATTERN = re.compile(r'{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*}', re.DOTALL)
+# 以SELECT、INSERT等关键字开头、以分号结尾的SQL语句
+# 使用[^;]*代替非贪婪的[\s\S]*?，匹配范围相同，但无需在每个字符处尝试匹配结尾
+SQL_STATEMENT_PATTERN = re.compile(r'(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[^;]*;', re.IGNORECASE)
+# SQL语句开头的语句类型关键字（允许前导空白，不区分大小写）
+SQL_TYPE_PATTERN = re.compile(r'\s*(select|insert|update|delete)', re.IGNORECASE)
+# 连续空白字符
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# SQL中的省略号或[其他字段]类型的占位符，一次扫描代替三次子串查找
+PLACEHOLDER_PATTERN = re.compile(r'\.\.\.|\[其他|其他\]')
+
 CODE_ORM_MYSQL_SQL_EXTRACT = \
     "这是一段基于goframe框架的ORM代码。goframe是Go语言的全栈开发框架，其ORM层支持链式操作、关联查询、事务处理、模型定义等多种功能。" \
     "请仔细分析代码中的表结构、字段映射、查询条件和操作类型，并完成以下任务：\n" \
@@ -171,11 +186,10 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
         function_definition = function_info.get('function_definition', '')
         sql_pattern_cnt = function_info.get('sql_pattern_cnt', None)
         
-        # 获取code_meta_data的所有元素
+        # 拼接code_meta_data的所有元素，生成与验证两个阶段各自所需的上下文每个函数只构建一次
         code_meta_data = function_info.get('code_meta_data', [])
-        code_meta_data_str = ""
-        for meta in code_meta_data:
-            code_meta_data_str += meta['code_value'] + "\n"
+        code_meta_data_str = build_code_chain(code_meta_data, 'code_value')
+        code_chain = build_code_chain(code_meta_data, 'code')
         # 初始化caller_results列表
         function_info['caller_results'] = []
         
@@ -206,7 +220,8 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
                 'function_info': function_info,
                 'caller': caller,
                 'caller_idx': caller_idx,
-                'task_id': task_id
+                'task_id': task_id,
+                'code_chain': code_chain
             }
         else:
             # 为每个caller创建任务
@@ -234,7 +249,8 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
                     'function_info': function_info,
                     'caller': caller,
                     'caller_idx': caller_idx,
-                    'task_id': task_id
+                    'task_id': task_id,
+                    'code_chain': code_chain
                 }
     
     # 并发等待所有SQL生成任务完成
@@ -282,7 +298,7 @@ async def process_json_file_async(input_file, output_file, concurrency=80):
             verify_sql_async(
                 sql_statement, 
                 function_definition=function_info.get('function_definition', ''),
-                code_meta_data=function_info.get('code_meta_data', []),
+                code_chain=task_info['code_chain'],
                 caller=caller,
                 semaphore=semaphore,
                 sql_pattern_cnt=function_info.get('sql_pattern_cnt', None)
@@ -463,6 +479,17 @@ def validate_input_file(input_file):
         print(f"输入文件验证失败: {e}")
         return False
 
+def build_code_chain(code_meta_data, field):
+    """将code_meta_data中各段代码拼接为一个字符串，每段代码后接换行
+
+    字符串元素直接使用，字典元素取field字段（生成阶段为code_value，验证阶段为code），缺少该字段的元素跳过
+    """
+    return ''.join(
+        f"{meta}\n" if isinstance(meta, str) else f"{meta[field]}\n"
+        for meta in code_meta_data
+        if isinstance(meta, str) or (isinstance(meta, dict) and field in meta)
+    )
+
 # 添加SQL分类功能
 def classify_sql(sql_statement):
     # 检查是否是字典类型（处理参数依赖的SQL变体）
@@ -472,34 +499,25 @@ def classify_sql(sql_statement):
             return "PARAM_DEPENDENT"
         # 尝试从字典中获取第一个SQL语句进行分类
         if "sql" in sql_statement and isinstance(sql_statement["sql"], str):
-            sql_lower = sql_statement["sql"].lower().strip()
+            sql = sql_statement["sql"]
         elif "variants" in sql_statement and len(sql_statement["variants"]) > 0:
             # 使用第一个变体的SQL进行分类
             first_variant = sql_statement["variants"][0]
             if "sql" in first_variant and isinstance(first_variant["sql"], str):
-                sql_lower = first_variant["sql"].lower().strip()
+                sql = first_variant["sql"]
             else:
                 return "OTHER"
         else:
             return "OTHER"
     elif isinstance(sql_statement, str):
-        # 原始的字符串处理逻辑
-        sql_lower = sql_statement.lower().strip()
+        sql = sql_statement
     else:
         # 处理其他类型
         return "OTHER"
     
-    # 分类逻辑
-    if sql_lower.startswith("select"):
-        return "SELECT"
-    elif sql_lower.startswith("insert"):
-        return "INSERT"
-    elif sql_lower.startswith("update"):
-        return "UPDATE"
-    elif sql_lower.startswith("delete"):
-        return "DELETE"
-    else:
-        return "OTHER"
+    # 分类逻辑：直接在原字符串上匹配开头的关键字，无需生成小写副本
+    match = SQL_TYPE_PATTERN.match(sql)
+    return match.group(1).upper() if match else "OTHER"
 
 # 添加缺失的函数
 async def send_request_async(question, semaphore):
@@ -532,7 +550,7 @@ async def send_request_async(question, semaphore):
         # 如果所有重试都失败，返回错误信息
         return f"请求失败: {question[:50]}..."
 
-async def verify_sql_async(sql_statement, function_definition=None, code_meta_data=None, caller=None, semaphore=None, sql_pattern_cnt=None):
+async def verify_sql_async(sql_statement, function_definition=None, code_chain=None, caller=None, semaphore=None, sql_pattern_cnt=None):
     async with semaphore:
         client = openai.AsyncClient(
             base_url="http://0.0.0.0:8081/v1", 
@@ -540,18 +558,10 @@ async def verify_sql_async(sql_statement, function_definition=None, code_meta_da
         )
         
         # 构建提示词，使用CODE_ORM_MYSQL_SQL_VERIFY模板
-        code_chain = ""
-        if code_meta_data and len(code_meta_data) > 0:
-            for meta in code_meta_data:
-                if isinstance(meta, str):
-                    code_chain += f"{meta}\n"
-                elif isinstance(meta, dict) and 'code' in meta:
-                    code_chain += f"{meta.get('code', '')}\n"
-        
         prompt = CODE_ORM_MYSQL_SQL_VERIFY.format(
             function_definition=function_definition if function_definition else "",
             caller=caller if caller else "",
-            code_chain=code_chain,
+            code_chain=code_chain if code_chain else "",
             sql_statement=sql_statement,
             sql_pattern_cnt=sql_pattern_cnt if sql_pattern_cnt is not None else ""
         )
@@ -613,7 +623,7 @@ async def format_sql_async(sql_statement, semaphore):
                     # 检查是否包含```json标记
                     if "```json" in formatted_response:
                         # 提取json部分
-                        match = re.search(r'```json\s*([\s\S]*?)```', formatted_response)
+                        match = JSON_CODE_BLOCK_PATTERN.search(formatted_response)
                         if match:
                             json_content = match.group(1).strip()
                             # 解析提取出的json内容
@@ -671,7 +681,7 @@ def validate_sql_completeness(sql_list):
     for item in sql_list:
         if isinstance(item, str):
             # 检查字符串中是否有省略号或[其他字段]类型的占位符
-            if "..." in item or "[其他" in item or "其他]" in item:
+            if PLACEHOLDER_PATTERN.search(item):
                 # 尝试修复或标记为不完整
                 print(f"发现不完整SQL语句: {item}")
                 # 这里可以添加修复逻辑或直接标记
@@ -683,7 +693,7 @@ def validate_sql_completeness(sql_list):
             fixed_variants = []
             for variant in item.get("variants", []):
                 sql = variant.get("sql", "")
-                if "..." in sql or "[其他" in sql or "其他]" in sql:
+                if PLACEHOLDER_PATTERN.search(sql):
                     print(f"发现不完整SQL变体: {sql}")
                     # 这里可以添加修复逻辑或直接标记
                     variant["sql"] = f"不完整SQL语句: {sql}"
@@ -730,11 +740,11 @@ def extract_sql_statements(text):
     # 这个函数尝试从文本中提取SQL语句，适用于LLM返回了带有说明的文本而不是纯JSON
     
     # 尝试提取param_dependent格式的SQL
-    param_dependent_matches = re.findall(r'{\s*"type"\s*:\s*"param_dependent"[^}]*"variants"\s*:\s*\[.*?\]\s*}', text, re.DOTALL)
+    param_dependent_matches = PARAM_DEPENDENT_PATTERN.findall(text)
     
     # 一般性SQL语句提取
     # 查找以SELECT、INSERT、UPDATE、DELETE等开头，以分号结尾的语句
-    sql_matches = re.findall(r'(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)[\s\S]*?;', text, re.IGNORECASE)
+    sql_matches = SQL_STATEMENT_PATTERN.findall(text)
     
     # 合并结果
     result = []
@@ -786,8 +796,8 @@ def compare_sql_statements(sql1, sql2):
     # 如果都是字符串，进行简化比较
     if isinstance(sql1, str) and isinstance(sql2, str):
         # 移除空格、换行和分号进行比较
-        simplified1 = re.sub(r'\s+', ' ', sql1).strip().rstrip(';').lower()
-        simplified2 = re.sub(r'\s+', ' ', sql2).strip().rstrip(';').lower()
+        simplified1 = WHITESPACE_PATTERN.sub(' ', sql1).strip().rstrip(';').lower()
+        simplified2 = WHITESPACE_PATTERN.sub(' ', sql2).strip().rstrip(';').lower()
         return simplified1 == simplified2
     
     # 如果都是字典（变体SQL）
@@ -807,13 +817,13 @@ def compare_sql_statements(sql1, sql2):
         sql_set1 = set()
         for variant in variants1:
             if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
+                simplified = WHITESPACE_PATTERN.sub(' ', variant['sql']).strip().rstrip(';').lower()
                 sql_set1.add(simplified)
         
         sql_set2 = set()
         for variant in variants2:
             if 'sql' in variant:
-                simplified = re.sub(r'\s+', ' ', variant['sql']).strip().rstrip(';').lower()
+                simplified = WHITESPACE_PATTERN.sub(' ', variant['sql']).strip().rstrip(';').lower()
                 sql_set2.add(simplified)
         
         # 如果两个集合有重叠，认为它们可能是相同的SQL
@@ -1,30 +1,57 @@
 import typing as t
-import inspect
+import os
 import json
-import traceback
-from sqlglot import exp, parse_one
+import logging
+import multiprocessing
+from sqlglot import exp
+from sqlglot.errors import ParseError
 from sqlglot.tokens import TokenType
 from sqlglot.expressions import Expression, Func, Insert
 from sqlglot.dialects.mysql import MySQL
 
+logger = logging.getLogger(__name__)
+
+# 优先使用orjson读写JSON，未安装时回退到标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads
+
+
+def load_json_file(path):
+    """读取并解析JSON文件"""
+    # 以二进制方式一次性读入，交给解析器直接处理UTF-8字节，省去文本层的逐块解码
+    with open(path, 'rb') as file:
+        return json_loads(file.read())
+
+def dump_json_file(data, path):
+    """将数据以缩进2格、保留非ASCII字符的格式写入JSON文件"""
+    if orjson:
+        # orjson在C中完成序列化，一次写出全部字节
+        with open(path, 'wb') as file:
+            file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+
+
 def clean_sql_text(sql_text: str) -> str:
     """
     清洗SQL文本，处理转义字符和格式问题
     """
-    # 处理 \n 转义字符，将其替换为实际的换行符
-    if "\\n" in sql_text:
-        sql_text = sql_text.replace("\\n", "\n")
+    # 处理 \n 转义字符，将其替换为实际的换行符（不含该转义时replace直接返回原字符串）
+    sql_text = sql_text.replace("\\n", "\n")
     
     # 将 { 替换为 [，} 替换为 ]，以适应解析器期望的语法
+    # 不改用str.translate：模板中常含中文注释，非ASCII文本的translate逐字符查表，比两次replace慢得多
     sql_text = sql_text.replace("{", "[").replace("}", "]")
     
     # 移除开头和结尾的多余空白字符
     sql_text = sql_text.strip()
     
-    print("清洗后的SQL文本:")
-    print("-" * 50)
-    print(sql_text)
-    print("-" * 50)
+    logger.debug("清洗后的SQL文本:\n%s", sql_text)
     
     return sql_text
 class OptBlockInClause:
@@ -42,13 +69,6 @@ clause_name_dict = {
 }
 
 
-parse_caller_to_clause_dict = {
-    "_parse_projections": OptBlockInClause.PROJECTION,
-    "_parse_group": OptBlockInClause.GROUP_BY,
-    "_parse_order": OptBlockInClause.ORDER_BY,
-}
-
-
 class Replace(Insert):
     pass
 
@@ -72,13 +92,6 @@ class OptBlock(Func):
     arg_types = {"this": True, "blocks": False}
 
 
-opt_func_to_class_dict = {
-    "OPTIONAL": OptionalFunc,
-    "REQUIRED": RequiredFunc,
-    "LOOP": LoopFunc,
-}
-
-
 def build_optional_func(args: t.List) -> exp.Expression:
     return OptionalFunc(this=list(args))
 
@@ -92,31 +105,23 @@ def build_loop_func(args: t.List) -> exp.Expression:
 
 
 def opt_block_sql(self: MySQL.Generator, expression: OptBlock) -> str:
-    blocks = expression.args["blocks"]
-    blocks_sql_list = [self.sql(b) for b in blocks]
-    sql = "OPT_BLOCK " + expression.name + "[" + ", ".join(blocks_sql_list) + "]"
-    return sql
+    blocks_sql = ", ".join([self.sql(b) for b in expression.args["blocks"]])
+    return f"OPT_BLOCK {expression.name}[{blocks_sql}]"
 
 
-def required_sql(self: MySQL.Generator, expression: RequiredFunc):
-    args = expression.args["this"]
-    args_sql_list = [self.sql(arg) for arg in args]
-    sql = "REQUIRED (" + ", ".join(args_sql_list) + ")"
-    return sql
+def build_opt_func_sql(func_name: str) -> t.Callable[[MySQL.Generator, Func], str]:
+    """构造REQUIRED/OPTIONAL/LOOP共用的生成方法，输出形如 func_name (arg1, arg2)"""
+    prefix = func_name + " ("
 
+    def opt_func_sql(self: MySQL.Generator, expression: Func) -> str:
+        return prefix + ", ".join([self.sql(arg) for arg in expression.args["this"]]) + ")"
 
-def optional_sql(self: MySQL.Generator, expression: OptionalFunc):
-    args = expression.args["this"]
-    args_sql_list = [self.sql(arg) for arg in args]
-    sql = "OPTIONAL (" + ", ".join(args_sql_list) + ")"
-    return sql
+    return opt_func_sql
 
 
-def loop_sql(self: MySQL.Generator, expression: LoopFunc):
-    args = expression.args["this"]
-    args_sql_list = [self.sql(arg) for arg in args]
-    sql = "LOOP (" + ", ".join(args_sql_list) + ")"
-    return sql
+required_sql = build_opt_func_sql("REQUIRED")
+optional_sql = build_opt_func_sql("OPTIONAL")
+loop_sql = build_opt_func_sql("LOOP")
 
 
 class DTMySQL(MySQL):
@@ -132,17 +137,39 @@ class DTMySQL(MySQL):
 
         NO_PAREN_FUNCTION_PARSERS = {
             **MySQL.Parser.NO_PAREN_FUNCTION_PARSERS,
-            "OPTIONAL": lambda self: self._parse_opt_func("OPTIONAL"),
-            "REQUIRED": lambda self: self._parse_opt_func("REQUIRED"),
-            "LOOP": lambda self: self._parse_opt_func("LOOP"),
+            # 直接传入对应的表达式类，解析时无需再按函数名查表
+            "OPTIONAL": lambda self: self._parse_opt_func(OptionalFunc, "OPTIONAL"),
+            "REQUIRED": lambda self: self._parse_opt_func(RequiredFunc, "REQUIRED"),
+            "LOOP": lambda self: self._parse_opt_func(LoopFunc, "LOOP"),
             "OPT_BLOCK": lambda self: self._parse_opt_block()
         }
 
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
+        def reset(self):
+            # 解析器会被复用，每次解析开始时（包括构造时）都恢复初始状态
+            super().reset()
             self.opt_block_in_clause = OptBlockInClause.EXPRESSION
+            # 当前所在的子句，由下面几个子句解析方法在进入时设置、退出时恢复，
+            # 因此总是对应最内层尚未解析完的投影/GROUP BY/ORDER BY子句
+            self.parsing_clause = OptBlockInClause.EXPRESSION
+
+        def _parse_in_clause(self, clause, parse_method, *args, **kwargs):
+            outer_clause = self.parsing_clause
+            self.parsing_clause = clause
+            try:
+                return parse_method(*args, **kwargs)
+            finally:
+                self.parsing_clause = outer_clause
+
+        def _parse_projections(self, *args, **kwargs):
+            return self._parse_in_clause(OptBlockInClause.PROJECTION, super()._parse_projections, *args, **kwargs)
+
+        def _parse_group(self, *args, **kwargs):
+            return self._parse_in_clause(OptBlockInClause.GROUP_BY, super()._parse_group, *args, **kwargs)
 
-        def _parse_opt_func(self, func_name) -> t.Optional[exp.Expression]:
+        def _parse_order(self, *args, **kwargs):
+            return self._parse_in_clause(OptBlockInClause.ORDER_BY, super()._parse_order, *args, **kwargs)
+
+        def _parse_opt_func(self, func_class, func_name) -> t.Optional[exp.Expression]:
             comments = self._prev_comments
 
             if not self._match(TokenType.L_PAREN):
@@ -163,10 +190,6 @@ class DTMySQL(MySQL):
                 if not self._match(TokenType.R_PAREN):
                     self.raise_error(f"Expected ) after {func_name}", self._prev)
 
-            func_class = opt_func_to_class_dict.get(func_name)
-            if func_class is None:
-                self.raise_error(f"Opt block function {func_name} is not supported", self._prev)
-
             return self.expression(
                 func_class, comments=comments, this=args
             )
@@ -175,13 +198,7 @@ class DTMySQL(MySQL):
             comments = self._prev_comments
             name = self._parse_id_var().name
 
-            stack = inspect.stack()
-            self.opt_block_in_clause = OptBlockInClause.EXPRESSION
-            for stack_info in stack:
-                opt_block_in_clause = parse_caller_to_clause_dict.get(stack_info.function)
-                if opt_block_in_clause is not None:
-                    self.opt_block_in_clause = opt_block_in_clause
-                    break
+            self.opt_block_in_clause = self.parsing_clause
 
             if not self._match(TokenType.L_BRACKET):
                 self.raise_error("Expected [ after OPT_BLOCK", self._prev)
@@ -210,33 +227,66 @@ class DTMySQL(MySQL):
 
 dialect = DTMySQL.__name__.lower()
 
+# 方言实例及其分词器、解析器、生成器只创建一次并复用，
+# 避免parse_one(read=dialect)/stmt.sql(dialect)每次调用都重新查找方言并实例化
+dialect_instance = DTMySQL()
+sql_tokenizer = dialect_instance.tokenizer_class(dialect=dialect_instance)
+sql_parser = dialect_instance.parser()
+sql_generator = dialect_instance.generator()
+
+
+def parse_first(sql: str) -> Expression:
+    """与parse_one(sql, read=dialect)相同，返回第一条语句的语法树，但复用模块级的分词器与解析器"""
+    for expression in sql_parser.parse(sql_tokenizer.tokenize(sql), sql):
+        if not expression:
+            raise ParseError(f"No expression was parsed from '{sql}'")
+        return expression
+    raise ParseError(f"No expression was parsed from '{sql}'")
+
 
 def parse(sql) -> Expression:
-    stmt = parse_one(sql, read=dialect)
+    stmt = parse_first(sql)
     stmt.sql()
     return stmt
 
 
 def generate(stmt: Expression) -> str:
-    sql = stmt.sql(dialect=dialect)
+    sql = sql_generator.generate(stmt)
     return sql
 
 def verify_sql(sql_text: str) -> bool:
     try:
-        stmt_exp = parse_one(sql_text, read=dialect)
-        print('-' * 50)
-        print('stmt_exp: ', stmt_exp)
-        sql_text = stmt_exp.sql(dialect)
-        print('-' * 50)
-        print('sql_text: ', sql_text)
-        print('-' * 50)
-        print('success!')
+        stmt_exp = parse_first(sql_text)
+        sql_text = sql_generator.generate(stmt_exp)
+        # 逐条打印会让大批量验证被输出拖慢，默认只输出失败信息，需要时调低日志级别查看
+        logger.debug("验证通过: %s", sql_text)
         return True
     except Exception as e:
-        print('sqlglot error: ', e)
+        logger.warning("sqlglot error: %s", e)
         return False
 
+def check_template(task):
+    """清洗并验证一条SQL模板，在进程池中执行
+
+    task为(item_idx, tmpl_idx, template)，返回(item_idx, tmpl_idx, 是否验证通过)，
+    处理模板时出现异常则记录异常信息，是否验证通过为None
+    """
+    item_idx, tmpl_idx, template = task
+    try:
+        clean_sql = clean_sql_text(template['template'])
+        return item_idx, tmpl_idx, verify_sql(clean_sql)
+    except Exception as e:
+        # 默认只记录异常类型与信息，日志级别为DEBUG时才附带完整堆栈
+        logger.error("处理模板出错: %s: %s, template: %s", type(e).__name__, e, template,
+                     exc_info=logger.isEnabledFor(logging.DEBUG))
+        return item_idx, tmpl_idx, None
+
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
 
     verify_sql_path=""
     check_templates_path=""
@@ -245,38 +295,38 @@ if __name__ == "__main__":
     include_success_chunk=0
     full_success_chunk=0
     failed_chunk=0
-    check_templates=[]
-    with open(verify_sql_path, 'r') as f:
-        data = json.load(f)
-    for item in data:
-        template_item = item
-        sql_templates = item['model_output']['formatted_templates']
-        full_success = True
-        include_success = False
-        for idx,template in enumerate(sql_templates):
-            try:
-                clean_sql = clean_sql_text(template['template'])
-                if verify_sql(clean_sql):
-                    total_success += 1
-                    include_success = True
-                    template_item['model_output']['formatted_templates'][idx]['success'] = True
-                else:
-                    total_failed += 1
-                    full_success = False
-                    template_item['model_output']['formatted_templates'][idx]['success'] = False
-            except Exception as e:
-                print('traceback.format_exc(): ', traceback.format_exc())
-                print('template: ', template)
-                pass
-        check_templates.append(template_item)
+    data = load_json_file(verify_sql_path)
+    # 所有模板相互独立，sqlglot解析是CPU密集的纯Python代码，展开后交给进程池并行验证
+    # 任务以生成器逐个产出，不再额外保存一份全部模板的任务列表
+    tasks = (
+        (item_idx, idx, template)
+        for item_idx, item in enumerate(data)
+        for idx, template in enumerate(item['model_output']['formatted_templates'])
+    )
+    item_full_success = [True] * len(data)
+    item_include_success = [False] * len(data)
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        for item_idx, idx, success in pool.imap_unordered(check_template, tasks, chunksize=64):
+            template_item = data[item_idx]
+            if success is None:
+                continue
+            if success:
+                total_success += 1
+                item_include_success[item_idx] = True
+                template_item['model_output']['formatted_templates'][idx]['success'] = True
+            else:
+                total_failed += 1
+                item_full_success[item_idx] = False
+                template_item['model_output']['formatted_templates'][idx]['success'] = False
+    for full_success, include_success in zip(item_full_success, item_include_success):
         if full_success:
             full_success_chunk += 1
         elif include_success:
             include_success_chunk += 1
         else:
             failed_chunk += 1
-    with open(check_templates_path, 'w', encoding='utf-8') as f:
-        json.dump(check_templates, f, indent=4, ensure_ascii=False)
+    # 验证结果已直接写回data中的各条模板，按输入顺序整体输出
+    dump_json_file(data, check_templates_path)
     print('total_success: ', total_success)
     print('total_failed: ', total_failed)
     print('full_success_chunk: ', full_success_chunk)
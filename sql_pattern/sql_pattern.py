@@ -2,9 +2,26 @@ import json
 import asyncio
 import os
 import openai
+import httpx
 from pathlib import Path
 import re
 import argparse
+import itertools
+
+# 优先使用orjson读写JSON，未安装时回退到标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads
+
+# 预编译解析第三轮输出用到的正则表达式
+# markdown代码块标记
+MD_FENCE_PATTERN = re.compile(r"^```json|```$", re.MULTILINE)
+# 兜底提取 [{"id": ..., "template": ...}, ...] 格式的JSON数组
+JSON_ARRAY_PATTERN = re.compile(r'\[\s*\{\s*"id"\s*:\s*"[^"]+"\s*,\s*"template"\s*:\s*"[^"]+"\s*\}(?:\s*,\s*\{\s*"id"\s*:\s*"[^"]+"\s*,\s*"template"\s*:\s*"[^"]+"\s*\})*\s*\]')
+
 # 第一轮提示词模板：SQL骨架分析
 PROMPT_TEMPLATE_FIRST_ROUND = r"""
 # 角色
@@ -272,20 +289,52 @@ JSON结构要求:
 {second_round_result}
 """
 
+def split_prompt_template(template, marker):
+    """在marker处将提示词模板拆分为固定前缀与动态部分的模板
+
+    固定前缀不含占位符，在此预先完成{{ }}转义的还原，构建提示词时只需格式化较短的动态部分
+    """
+    index = template.index(marker)
+    return template[:index].format(), template[index:]
+
+FIRST_ROUND_PROMPT_PREFIX, FIRST_ROUND_PROMPT_SUFFIX = split_prompt_template(PROMPT_TEMPLATE_FIRST_ROUND, "# 输入")
+SECOND_ROUND_PROMPT_PREFIX, SECOND_ROUND_PROMPT_SUFFIX = split_prompt_template(PROMPT_TEMPLATE_SECOND_ROUND, "输入数据")
+THIRD_ROUND_PROMPT_PREFIX, THIRD_ROUND_PROMPT_SUFFIX = split_prompt_template(PROMPT_TEMPLATE_THIRD_ROUND, "原始模板文本:")
+
+def load_json_file(path):
+    """读取并解析JSON文件"""
+    # 以二进制方式一次性读入，交给解析器直接处理UTF-8字节，省去文本层的逐块解码
+    with open(path, 'rb') as file:
+        return json_loads(file.read())
+
+def dump_json_bytes(data):
+    """将数据序列化为缩进2格、保留非ASCII字符的UTF-8 JSON字节串"""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+# 连接池大小，需不小于并发请求数，否则超出部分的请求要排队等待连接或反复新建连接
+LLM_MAX_CONNECTIONS = 256
+
+# 所有请求共用一个客户端，复用其连接池中的长连接
+LLM_CLIENT = openai.AsyncClient(
+    base_url="http://0.0.0.0:8081/v1",
+    api_key="EMPTY",
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        timeout=httpx.Timeout(600.0, connect=10.0)
+    )
+)
+
 async def send_request_async(question, semaphore):
     """发送API请求并获取结果"""
     async with semaphore:
-        client = openai.AsyncClient(
-            base_url="http://0.0.0.0:8081/v1", 
-            api_key="EMPTY"
-        )
-        
         max_retries = 3
         retry_count = 0
         
         while retry_count < max_retries:
             try:
-                response = await client.chat.completions.create(
+                response = await LLM_CLIENT.chat.completions.create(
                     model="default",
                     messages=[
                         {"role": "system", "content": ""},
@@ -316,7 +365,7 @@ async def process_item(item_key, item_data, semaphore, output_dir):
         else:
             caller = caller[0]
         # 第一轮：SQL骨架分析
-        first_round_prompt = PROMPT_TEMPLATE_FIRST_ROUND.format(
+        first_round_prompt = FIRST_ROUND_PROMPT_PREFIX + FIRST_ROUND_PROMPT_SUFFIX.format(
             orm_code=function_definition,
             code_meta_data=code_meta_data,
             caller=caller
@@ -326,7 +375,7 @@ async def process_item(item_key, item_data, semaphore, output_dir):
         first_round_result = await send_request_async(first_round_prompt, semaphore)
         
         # 第二轮：结果生成
-        second_round_prompt = PROMPT_TEMPLATE_SECOND_ROUND.format(
+        second_round_prompt = SECOND_ROUND_PROMPT_PREFIX + SECOND_ROUND_PROMPT_SUFFIX.format(
             orm_code=function_definition,
             code_meta_data=code_meta_data,
             caller=caller,
@@ -336,7 +385,7 @@ async def process_item(item_key, item_data, semaphore, output_dir):
         second_round_result = await send_request_async(second_round_prompt, semaphore)
         
         # 第三轮：格式化处理
-        third_round_prompt = PROMPT_TEMPLATE_THIRD_ROUND.format(
+        third_round_prompt = THIRD_ROUND_PROMPT_PREFIX + THIRD_ROUND_PROMPT_SUFFIX.format(
             second_round_result=second_round_result
         )
         
@@ -383,7 +432,7 @@ def clean_and_parse_sql_templates(raw_result):
     处理第三轮输出，去除markdown代码块、转义字符，并解析为JSON对象。
     """
     # 去除markdown代码块标记
-    cleaned = re.sub(r"^```json|```$", "", raw_result.strip(), flags=re.MULTILINE)
+    cleaned = MD_FENCE_PATTERN.sub("", raw_result.strip())
     cleaned = cleaned.strip()
     
     # 输出清理前后的内容以便调试
@@ -419,8 +468,7 @@ def clean_and_parse_sql_templates(raw_result):
             print(f"第二次JSON解析仍然失败: {str(e2)}")
             
             # 尝试通过正则表达式直接提取JSON数组格式
-            json_pattern = r'\[\s*\{\s*"id"\s*:\s*"[^"]+"\s*,\s*"template"\s*:\s*"[^"]+"\s*\}(?:\s*,\s*\{\s*"id"\s*:\s*"[^"]+"\s*,\s*"template"\s*:\s*"[^"]+"\s*\})*\s*\]'
-            json_match = re.search(json_pattern, cleaned)
+            json_match = JSON_ARRAY_PATTERN.search(cleaned)
             
             if json_match:
                 try:
@@ -471,8 +519,7 @@ async def main():
     
     # 读取输入文件
     try:
-        with open(input_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = load_json_file(input_file)
     except Exception as e:
         print(f"读取输入文件时出错: {e}")
         return
@@ -480,32 +527,56 @@ async def main():
     # 设置并发数
     semaphore = asyncio.Semaphore(max_concurrent)
     
-    # 创建所有任务
-    tasks = []
-    for item_key, item_data in data.items():
-            
-        task = process_item(item_key, item_data, semaphore, output_dir)
-        tasks.append(task)
-        # break  # 测试时只处理一个项目
+    # 同时在途的项目数上限。每个项目的三轮请求依次进行，保留并发数两倍的项目足以用满并发额度，
+    # 其余项目等有项目完成后再创建任务，不必一开始就为全部项目创建协程并排队等待信号量
+    max_pending = max_concurrent * 2
+    items_to_process = iter(data.items())
+    pending = set()
     
-    # 执行所有任务
-    results = await asyncio.gather(*tasks)
+    path = os.path.join(output_dir, output_filename)
+    total_count = len(data)
+    success_count = 0
+    # 统计错误类型
+    error_types = {}
+    items = {}
     
-    # 统计结果
-    success_count = sum(1 for _, success, _, _ in results if success)
-    total_count = len(tasks)
+    # 按完成顺序逐条将详细结果写入输出文件（JSON数组），内存中只保留统计所需的信息，
+    # 中途中断时已完成的结果也已落盘
+    with open(path, 'wb') as f:
+        f.write(b'[')
+        written_count = 0
+        while True:
+            # 补足在途项目
+            for item_key, item_data in itertools.islice(items_to_process, max_pending - len(pending)):
+                pending.add(asyncio.create_task(process_item(item_key, item_data, semaphore, output_dir)))
+            if not pending:
+                break
+            
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                key, success, input_data, model_output = task.result()
+                f.write(b'\n' if written_count == 0 else b',\n')
+                f.write(dump_json_bytes({
+                    "key": key,
+                    "success": success,
+                    "input_data": input_data,
+                    "model_output": model_output
+                }))
+                written_count += 1
+                
+                items[key] = success
+                if success:
+                    success_count += 1
+                elif "error_type" in model_output:
+                    error_type = model_output["error_type"]
+                    if error_type not in error_types:
+                        error_types[error_type] = []
+                    error_types[error_type].append(key)
+            f.flush()
+        f.write(b'\n]\n')
     
     print(f"处理完成: {success_count}/{total_count} 项成功")
     
-    # 统计错误类型
-    error_types = {}
-    for key, success, _, output in results:
-        if not success and "error_type" in output:
-            error_type = output["error_type"]
-            if error_type not in error_types:
-                error_types[error_type] = []
-            error_types[error_type].append(key)
-    
     # 打印错误类型统计
     print("\n错误类型统计:")
     for error_type, keys in error_types.items():
@@ -520,24 +591,8 @@ async def main():
         "success": success_count,
         "success_rate": success_count / total_count if total_count > 0 else 0,
         "error_types": {error_type: len(keys) for error_type, keys in error_types.items()},
-        "items": {key: success for key, success, _, _ in results}
+        "items": items
     }
-    
-    # 假设 results = [(key, success, input_data, model_output), ...]
-    detailed_results = []
-    for key, success, input_data, model_output in results:
-        detailed_results.append({
-            "key": key,
-            "success": success,
-            "input_data": input_data,
-            "model_output": model_output
-        })
-    path = os.path.join(output_dir, output_filename)
-    # 写入详细结果
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(detailed_results, f, ensure_ascii=False, indent=2)
-    
-        
 
     print(f"已写入详细结果: {path}")
 